@@ -0,0 +1,488 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from lrs_client import LRSClient
+from lrs_request import (
+    CONTEXT_EXTENSION,
+    PROGRESS_EXTENSION,
+    SCORE_EXTENSION,
+    calculate_time_per_level,
+    fetch_lrs_data,
+    process_data,
+    project_statement,
+)
+from level_stats import (
+    COMPLETIONS,
+    SCORE_COUNT,
+    SCORE_MAX,
+    SCORE_MIN,
+    STATEMENTS,
+    LevelStatsAccumulator,
+    build_level_cube,
+)
+from mock_lrs import MockLRS
+from schema import from_compact, to_compact
+from score import LEVELS_DIR, extract_scores, get_level_catalog
+from synthetic import generate_statements
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+REPEAT = 3  # Exécutions mesurées par cas, le meilleur temps est gardé
+TIME_TOLERANCE = 0.5  # Ralentissement accepté par rapport à la référence (+50 %)
+MEMORY_TOLERANCE = 0.2  # Hausse du pic mémoire acceptée (+20 %)
+MIN_TIME_DELTA = 0.005  # Écarts de temps ignorés en dessous de 5 ms (bruit de mesure)
+
+def generate_frame(count, levels=20, seed=0):
+    # Table déjà traitée (schéma compact), pour mesurer calculate_time_per_level
+    # sans process_data
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-01", tz="UTC").value
+    return pd.DataFrame(
+        {
+            "Timestamp": start + rng.integers(0, 30 * 86400, count) * 10**9,
+            "Mission Level": pd.Categorical(
+                [f"mission{i:02d}" for i in rng.integers(1, levels + 1, count)]
+            ),
+        }
+    )
+
+
+def process_data_reference(data):
+    # Implémentation d'origine de process_data, gardée comme référence
+    records = []
+    last_mission_level = None
+    all_mission_levels = set()
+    completed_counts = {}
+    score_by_level = {}
+
+    for statement in data:
+        try:
+            success = statement.get("result", {}).get("success", False)
+            score = (
+                statement.get("result", {})
+                .get("extensions", {})
+                .get(SCORE_EXTENSION, None)
+            )
+
+            if not success:
+                score = None
+
+            if score:
+                if isinstance(score, list) and len(score) > 0:
+                    score = score[0]
+
+                if isinstance(score, str):
+                    score = float(score)
+
+                if isinstance(score, (int, float)):
+                    score = float(score)
+                else:
+                    score = None
+            else:
+                score = None
+
+            mission_level = None
+            scenario = None
+            if "object" in statement:
+                object_data = statement["object"]
+                if "definition" in object_data:
+                    definition = object_data["definition"]
+                    if "extensions" in definition:
+                        extensions = definition["extensions"]
+                        if PROGRESS_EXTENSION in extensions:
+                            mission_level = extensions[PROGRESS_EXTENSION][0]
+                        if CONTEXT_EXTENSION in extensions:
+                            scenario = extensions[CONTEXT_EXTENSION][0]
+
+            if mission_level is None and last_mission_level is not None:
+                mission_level = last_mission_level
+
+            if mission_level is not None:
+                last_mission_level = mission_level
+                all_mission_levels.add(mission_level)
+
+                verb = statement["verb"]["id"].split("/")[-1]
+                if verb == "completed":
+                    if mission_level not in completed_counts:
+                        completed_counts[mission_level] = 0
+                    completed_counts[mission_level] += 1
+
+                if mission_level not in score_by_level:
+                    score_by_level[mission_level] = []
+                if score is not None:
+                    score_by_level[mission_level].append(score)
+
+            records.append(
+                {
+                    "Timestamp": statement.get("timestamp"),
+                    "Verb": statement["verb"]["id"].split("/")[-1],
+                    "Actor": statement["actor"].get("name", "Unknown"),
+                    "Object": statement["object"].get("id", "Unknown"),
+                    "Score": score,
+                    "Mission Level": mission_level,
+                    "Scenario": scenario,
+                }
+            )
+        except Exception:
+            continue
+
+        avg_score_by_level = {
+            level: round(sum(scores) / len(scores)) if len(scores) > 0 else None
+            for level, scores in score_by_level.items()
+        }
+        max_score_by_level = {
+            level: max(scores) if len(scores) > 0 else None
+            for level, scores in score_by_level.items()
+        }
+
+    df = pd.DataFrame(records)
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"])
+    return (
+        df,
+        list(all_mission_levels),
+        completed_counts,
+        avg_score_by_level,
+        max_score_by_level,
+    )
+
+
+def calculate_time_per_level_reference(df):
+    # Implémentation d'origine de calculate_time_per_level, gardée comme référence
+    def timestamps_to_minutes(group):
+        base_time = group.min()
+        return (group - base_time).dt.total_seconds() / 60
+
+    minutes_per_level = (
+        df.dropna(subset=["Mission Level"])
+        .groupby("Mission Level")["Timestamp"]
+        .apply(lambda x: list(timestamps_to_minutes(x)))
+        .reset_index(name="Minutes Elapsed")
+    )
+    minutes_per_level["Minutes Elapsed"] = minutes_per_level["Minutes Elapsed"].apply(
+        lambda x: [t for t in x if t > 0.05]
+    )
+    minutes_per_level["Max Time Spent"] = minutes_per_level["Minutes Elapsed"].apply(
+        lambda x: max(x) if len(x) > 0 else 0
+    )
+    minutes_per_level["Min Time Spent"] = minutes_per_level["Minutes Elapsed"].apply(
+        lambda x: min([t for t in x if t > 0.01], default=None)
+    )
+    minutes_per_level["Average Duration"] = minutes_per_level["Minutes Elapsed"].apply(
+        lambda x: sum(x) / len(x) if len(x) > 0 else 0
+    )
+    minutes_per_level = minutes_per_level[minutes_per_level["Max Time Spent"] <= 24 * 60]
+    return tuple(
+        dict(zip(minutes_per_level["Mission Level"], minutes_per_level[column]))
+        for column in ("Max Time Spent", "Min Time Spent", "Average Duration")
+    )
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def measure(function, *args, repeat=REPEAT):
+    # Meilleur temps sur repeat exécutions, puis pic mémoire (tracemalloc) sur
+    # une exécution à part : tracemalloc ralentit le code mesuré
+    seconds = min(timed(function, *args)[1] for _ in range(repeat))
+    tracemalloc.start()
+    try:
+        timed(function, *args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_mb": peak / 1024**2}
+
+
+def check_identical(expected, actual):
+    # Seule différence voulue : process_data reporte aussi le scénario sur les
+    # statements sans niveau, la référence ne reporte que le niveau
+    pd.testing.assert_frame_equal(
+        to_compact(expected[0]).drop(columns="Scenario"), actual[0].drop(columns="Scenario")
+    )
+    assert set(expected[1]) == set(actual[1])
+    for position in (2, 3, 4):
+        assert expected[position] == actual[position]
+        assert list(expected[position]) == list(actual[position])
+
+
+def check_same_times(expected, actual):
+    for expected_times, actual_times in zip(expected, actual):
+        assert list(expected_times) == list(actual_times)
+        for level, value in expected_times.items():
+            assert np.isclose(value, actual_times[level], equal_nan=True)
+
+
+def compare_process_data(sizes):
+    # Comparaison à l'implémentation d'origine : résultats identiques et gain
+    for size in sizes:
+        statements = generate_statements(size)
+        result, elapsed = timed(process_data, statements)
+        expected, reference = timed(process_data_reference, statements)
+        check_identical(expected, result)
+        print(
+            f"process_data {size:>8} statements : {elapsed:8.3f} s "
+            f"| référence : {reference:8.3f} s | x{reference / elapsed:.1f}"
+        )
+
+
+def compare_time_per_level(sizes):
+    for size in sizes:
+        df = generate_frame(size)
+        result, elapsed = timed(calculate_time_per_level, df)
+        expected, reference = timed(
+            calculate_time_per_level_reference,
+            df.assign(Timestamp=pd.to_datetime(df["Timestamp"], utc=True)),
+        )
+        check_same_times(expected, result)
+        print(
+            f"calculate_time_per_level {size:>8} statements : {elapsed:8.3f} s "
+            f"| référence : {reference:8.3f} s | x{reference / elapsed:.1f}"
+        )
+
+
+def compare_level_cube(sizes):
+    # Le cube du tableau de bord (build_level_cube sur la table de
+    # process_data) compte les mêmes statements que LevelStatsAccumulator
+    for size in sizes:
+        statements = generate_statements(size)
+        df = process_data(statements)[0]
+        cube = build_level_cube(df)
+        accumulator = LevelStatsAccumulator().update(statements)
+        expected = {
+            (scenario, level): (
+                stats[STATEMENTS],
+                stats[COMPLETIONS],
+                stats[SCORE_COUNT],
+                stats[SCORE_MAX],
+                stats[SCORE_MIN],
+            )
+            for (scenario, level), stats in accumulator.stats.items()
+            if scenario is not None
+        }
+        actual = {
+            (scenario, level): (
+                stats["statements"],
+                stats["completions"],
+                stats["score_count"],
+                stats["max_score"],
+                stats["min_score"],
+            )
+            for scenario, levels in cube.items()
+            for level, stats in levels.items()
+        }
+        assert actual == expected
+        print(f"cube par niveau {size:>8} statements : {len(actual)} niveaux identiques")
+
+
+def compare_incremental_stats(sizes, splits=50):
+    # Statistiques tenues à jour par lots successifs (sync_aggregates) :
+    # identiques à un passage complet, même coupées au milieu d'un essai
+    for size in sizes:
+        statements = generate_statements(size)
+        expected = LevelStatsAccumulator().update(statements).stats
+        rng = np.random.default_rng(0)
+        for _ in range(splits):
+            cuts = sorted(rng.choice(np.arange(1, size), size=3, replace=False))
+            batches = [statements[a:b] for a, b in zip([0, *cuts], [*cuts, size])]
+            # Du lot le plus ancien au plus récent, relu depuis JSON à chaque fois
+            accumulator = LevelStatsAccumulator().update(batches[-1])
+            for batch in reversed(batches[:-1]):
+                accumulator = LevelStatsAccumulator.from_json(accumulator.to_json())
+                accumulator.prepend(LevelStatsAccumulator().update(batch))
+            assert accumulator.stats == expected
+        print(f"statistiques incrémentales {size:>8} statements : {splits} découpages identiques")
+
+
+def graph_path(statements):
+    # Chemin complet du tableau de bord : traitement des statements, cube par
+    # scénario puis tous les graphiques (remplace l'ancien update_graphs)
+    import tableau_final
+
+    player_data = tableau_final.build_player_data(statements)
+    key = f"benchmark/{id(player_data)}"
+    tableau_final.get_data_cache().put(key, player_data)
+    data = {"key": key, "username": "benchmark"}
+    figures = [
+        tableau_final.update_player_stars(data, "benchmark"),
+        tableau_final.update_total_stars(data, "benchmark"),
+    ]
+    # Graphiques par niveau construits en entier (drawn=None), comme au
+    # premier affichage
+    for scenario in player_data["cube"]:
+        figures += [
+            tableau_final.update_avg_score(scenario, data, "benchmark", None)[0],
+            tableau_final.update_max_score(scenario, data, "benchmark", None)[0],
+            tableau_final.update_completed_counts(scenario, data, "benchmark", None)[0],
+        ]
+        for time_spent in tableau_final.TIME_SPENT_KEYS:
+            figures.append(
+                tableau_final.update_time_spent(
+                    scenario, time_spent, data, "benchmark", None
+                )[0]
+            )
+    tableau_final.get_data_cache().discard(key)
+    return figures
+
+
+def run_suite(args):
+    results = {}
+
+    def record(name, function, *function_args):
+        results[name] = measure(function, *function_args, repeat=args.repeat)
+        print(
+            f"{name:<36} {results[name]['seconds']:9.4f} s "
+            f"{results[name]['peak_mb']:9.1f} Mo"
+        )
+
+    for size in args.sizes:
+        record(f"process_data/{size}", process_data, generate_statements(size))
+    for size in args.time_sizes:
+        record(f"calculate_time_per_level/{size}", calculate_time_per_level, generate_frame(size))
+    record("extract_scores", extract_scores, LEVELS_DIR)
+    get_level_catalog()
+    record("get_level_catalog (en cache)", get_level_catalog)
+    for size in args.graph_sizes:
+        record(f"graphiques/{size}", graph_path, generate_statements(size))
+    # Pagination et décodage des réponses, avec le LRS local de mock_lrs.py
+    for size in args.lrs_sizes:
+        mock = MockLRS(generate=size)
+        client = LRSClient(endpoint=mock.start())
+        fetch_lrs_data("benchmark", client=client)  # Statements générés une fois
+        record(f"lrs_fetch/{size}", fetch_lrs_data, "benchmark", 500, None, client)
+        mock.stop()
+    return results
+
+
+def check_regressions(results, baseline, time_tolerance, memory_tolerance):
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            print(f"{name} : pas de référence enregistrée")
+            continue
+        if result["seconds"] > max(
+            expected["seconds"] * (1 + time_tolerance),
+            expected["seconds"] + MIN_TIME_DELTA,
+        ):
+            regressions.append(
+                f"{name} : {result['seconds']:.4f} s au lieu de {expected['seconds']:.4f} s"
+            )
+        if result["peak_mb"] > expected["peak_mb"] * (1 + memory_tolerance):
+            regressions.append(
+                f"{name} : {result['peak_mb']:.1f} Mo au lieu de {expected['peak_mb']:.1f} Mo"
+            )
+    return regressions
+
+
+def bench_memory(size):
+    # Mémoire de la table des statements avec des chaînes Python, des dates et
+    # des scores en float64, puis avec le schéma compact, ramenée à 10^6 lignes
+    compact = process_data(generate_statements(size))[0]
+    legacy = from_compact(compact)
+    scale = 10**6 / len(compact)
+    for name, frame in (("chaînes et dates", legacy), ("schéma compact", compact)):
+        usage = frame.memory_usage(deep=True)
+        print(
+            f"mémoire {name:>16} : {usage.sum() * scale / 1024**2:8.1f} Mo "
+            f"par million de statements"
+        )
+        for column in compact.columns:
+            print(f"    {column:<14} {str(frame[column].dtype):<20} "
+                  f"{usage[column] * scale / 1024**2:8.1f} Mo")
+
+
+def bench_statement_size(size):
+    # Taille des statements complets et réduits par project_statement : JSON
+    # (réponse du LRS, cache local) et objets Python gardés en mémoire
+    statements = generate_statements(size)
+    for name, project in (("complets", False), ("réduits", True)):
+        payloads = [
+            json.dumps(project_statement(statement) if project else statement)
+            for statement in statements
+        ]
+        tracemalloc.start()
+        loaded = [json.loads(payload) for payload in payloads]
+        python_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del loaded
+        print(
+            f"statements {name:>8} : {sum(map(len, payloads)) / size:6.0f} octets JSON, "
+            f"{python_bytes / size:6.0f} octets en mémoire par statement"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesure des performances du traitement")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--time-sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--graph-sizes", type=int, nargs="+", default=[10000])
+    parser.add_argument("--lrs-sizes", type=int, nargs="+", default=[10000])
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Enregistrer les mesures comme nouvelle référence",
+    )
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument(
+        "--reference",
+        action="store_true",
+        help="Comparer aussi à l'implémentation d'origine (lente)",
+    )
+    parser.add_argument(
+        "--memory-size",
+        type=int,
+        default=100000,
+        help="Statements utilisés pour estimer la mémoire par million de statements",
+    )
+    args = parser.parse_args()
+
+    if args.reference:
+        compare_process_data(args.sizes)
+        compare_time_per_level(args.time_sizes)
+        compare_level_cube(args.sizes)
+        compare_incremental_stats(args.sizes)
+    results = run_suite(args)
+    bench_memory(args.memory_size)
+    bench_statement_size(args.memory_size)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Référence enregistrée dans {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("Pas de référence : lancer avec --update-baseline pour l'enregistrer")
+        return
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = check_regressions(
+        results, baseline, args.time_tolerance, args.memory_tolerance
+    )
+    if regressions:
+        print("Régressions par rapport à la référence :")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("Aucune régression par rapport à la référence")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from level_stats import level_entry
+from lrs_client import LRSError
+from lrs_request import fetch_many
+from score import get_level_catalog
+from stars import star_tables
+from statement_store import StatementStore, get_store
+
+# Processus utilisés pour traiter les joueurs d'une cohorte. Chaque processus
+# du serveur (SPY_WORKERS, exporté par gunicorn.conf.py) a son propre pool :
+# les cœurs sont partagés entre eux.
+SERVER_WORKERS = max(1, int(os.environ.get("SPY_WORKERS", 1)))
+COHORT_PROCESSES = int(
+    os.environ.get("SPY_COHORT_PROCESSES", max(1, (os.cpu_count() or 1) // SERVER_WORKERS))
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def parse_agent_names(text):
+    # Noms séparés par des retours à la ligne, des virgules, des points-virgules
+    # ou des espaces (copiés depuis un tableur ou un fichier CSV), sans doublons
+    names = [name.strip() for name in re.split(r"[\s,;]+", text or "")]
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def get_process_pool():
+    # Pool de processus partagé, créé au premier chargement d'une cohorte. Les
+    # processus sont démarrés avec "spawn" : le serveur Dash tourne dans
+    # plusieurs threads, qu'un fork recopierait dans un état incohérent.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=COHORT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def summarize_player(store_path, agent_name):
+    # Exécuté dans un processus du pool : les statistiques par niveau tenues à
+    # jour par sync_aggregates sont relues, sans retraiter l'historique. Seul
+    # un joueur dont la synchronisation a échoué est recompté sur le cache.
+    accumulator = StatementStore(store_path).aggregates(agent_name)
+    # Scénarios puis niveaux triés, comme dans le cube d'un joueur
+    levels = [
+        {
+            "Player": agent_name,
+            "Scenario": scenario,
+            "Mission Level": level,
+            **level_entry(stats),
+        }
+        for (scenario, level), stats in sorted(
+            (key, stats) for key, stats in accumulator.stats.items() if key[0] is not None
+        )
+    ]
+    df_player_stars, df_total_stars = star_tables(
+        accumulator.max_score_by_level(), get_level_catalog()
+    )
+    stars = df_total_stars.assign(Player=agent_name).to_dict("records")
+    return levels, stars
+
+
+def sync_cohort(agent_names, store=None, client=None, on_progress=None):
+    # Synchronise les joueurs en parallèle (requêtes réseau, des threads
+    # suffisent). Un joueur déjà en cache reste utilisable si le LRS échoue.
+    store = store or get_store()
+    on_done = None
+    if on_progress is not None:
+        on_done = lambda done: on_progress(synced=done)
+    synced, failed = fetch_many(
+        agent_names, client=client, fetch=store.sync_aggregates, on_done=on_done
+    )
+    errors = {
+        agent_name: str(error)
+        for agent_name, error in failed.items()
+        if not (isinstance(error, LRSError) and store.is_known(agent_name))
+    }
+    # Même ordre que la liste donnée
+    return [name for name in dict.fromkeys(agent_names) if name not in errors], errors
+
+
+def summarize_cohort(agent_names, store=None, on_progress=None):
+    # Les statistiques de chaque joueur sont lues (ou recalculées après un
+    # échec de synchronisation) sur le pool de processus
+    store = store or get_store()
+    pool = get_process_pool()
+    futures = {
+        pool.submit(summarize_player, store.path, agent_name): agent_name
+        for agent_name in agent_names
+    }
+    summaries = {}
+    errors = {}
+    try:
+        for done, future in enumerate(as_completed(futures), start=1):
+            agent_name = futures[future]
+            try:
+                summaries[agent_name] = future.result()
+            except Exception as e:
+                errors[agent_name] = str(e)
+            if on_progress is not None:
+                on_progress(processed=done)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return [summaries[name] for name in agent_names if name in summaries], errors
+
+
+def build_cohort(summaries, players):
+    # Fusionne les agrégats des joueurs en agrégats de cohorte
+    levels = pd.DataFrame(
+        [row for player_levels, _ in summaries for row in player_levels],
+        columns=[
+            "Player",
+            "Scenario",
+            "Mission Level",
+            "statements",
+            "completions",
+            "score_count",
+            "avg_score",
+            "max_score",
+            "min_score",
+        ],
+    )
+    stars = pd.DataFrame(
+        [row for _, player_stars in summaries for row in player_stars],
+        columns=[
+            "Player",
+            "Scénario",
+            "Nombre d'étoiles total par scénario",
+            "Nombre d'étoiles du joueur par scénario",
+        ],
+    )
+    summary = (
+        levels.assign(completed=levels["completions"] > 0)
+        .groupby(["Scenario", "Mission Level"])
+        .agg(
+            players=("Player", "nunique"),
+            completed_players=("completed", "sum"),
+            statements=("statements", "sum"),
+            completions=("completions", "sum"),
+            median_max_score=("max_score", "median"),
+        )
+        .reset_index()
+    )
+    # Part de toute la cohorte ayant complété le niveau au moins une fois
+    summary["completion_rate"] = summary["completed_players"] / max(len(players), 1)
+    return {"players": players, "levels": levels, "stars": stars, "summary": summary}
+
+
+def load_cohort(agent_names, store=None, client=None, on_progress=None):
+    store = store or get_store()
+    available, errors = sync_cohort(agent_names, store, client, on_progress)
+    summaries, processing_errors = summarize_cohort(available, store, on_progress)
+    errors.update(processing_errors)
+    players = [name for name in available if name not in processing_errors]
+    cohort = build_cohort(summaries, players)
+    cohort["errors"] = errors
+    return cohort
@@ -0,0 +1,129 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+
+import metrics
+
+MAX_ENTRIES = 64  # Joueurs gardés en mémoire au plus
+TTL = 30 * 60  # Secondes avant qu'une entrée inutilisée ne soit oubliée
+MEMORY_BUDGET = 512 * 1024**2  # Octets occupés au plus par les entrées
+
+
+def estimate_size(value):
+    # Estimation de la mémoire occupée par une entrée (DataFrame et dictionnaires)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(key) + estimate_size(item) for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class DataCache:
+    # Cache LRU côté serveur des données traitées par joueur : le navigateur ne
+    # garde que la clé, les callbacks relisent les DataFrames déjà construits
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL, memory_budget=MEMORY_BUDGET):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.entries = OrderedDict()  # {clé: (valeur, taille, dernier accès)}
+        self.size = 0
+        self.lock = threading.Lock()
+        self.building = {}  # {clé: Future} des entrées en cours de reconstruction
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                metrics.cache_access("data", hit=False)
+                return None
+            value, size, last_access = entry
+            if time.monotonic() - last_access > self.ttl:
+                self.remove(key)
+                metrics.cache_access("data", hit=False)
+                return None
+            metrics.cache_access("data", hit=True)
+            self.entries[key] = (value, size, time.monotonic())
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, size, time.monotonic())
+            self.size += size
+            self.evict()
+
+    def get_or_build(self, key, build):
+        # Entrée absente : build() n'est appelé qu'une fois par clé, les autres
+        # callbacks qui la demandent en même temps attendent son résultat
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry[0]
+            future = self.building.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.building[key] = future
+        if not owner:
+            return future.result()
+        try:
+            value = build()
+        except BaseException as e:
+            with self.lock:
+                del self.building[key]
+            future.set_exception(e)
+            raise
+        self.put(key, value)
+        with self.lock:
+            del self.building[key]
+        future.set_result(value)
+        return value
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+    def remove(self, key):
+        value, size, last_access = self.entries.pop(key)
+        self.size -= size
+
+    def evict(self):
+        # Les entrées expirées partent d'abord, puis les moins récemment utilisées
+        now = time.monotonic()
+        for key in [k for k, entry in self.entries.items() if now - entry[2] > self.ttl]:
+            self.remove(key)
+        while len(self.entries) > self.max_entries or (
+            self.size > self.memory_budget and len(self.entries) > 1
+        ):
+            self.remove(next(iter(self.entries)))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_data_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DataCache()
+        return _cache
@@ -0,0 +1,76 @@
+from functools import lru_cache
+
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+from dash import Patch
+
+# Mise en page commune des graphiques, construite une fois au chargement du
+# module au lieu d'être répétée dans chaque update_layout
+MARGIN = dict(l=40, r=40, t=40, b=40)
+# Graphiques d'entiers (scores, essais, étoiles) : une graduation par unité
+LEVEL_LAYOUT = dict(margin=MARGIN, yaxis=dict(tickmode="linear", dtick=1))
+COHORT_LAYOUT = dict(margin=MARGIN)
+
+
+def figure_layout(xaxis_title, yaxis_title, base=LEVEL_LAYOUT, **layout):
+    return {**base, "xaxis_title": xaxis_title, "yaxis_title": yaxis_title, **layout}
+
+
+def level_bar(df, y, title):
+    # Barres par niveau avec leur valeur au-dessus (scores, essais, temps passé)
+    fig = px.bar(df, x="Mission Level", y=y, title=title, text=y)
+    fig.update_traces(texttemplate="%{text}", textposition="outside")
+    fig.update_layout(**figure_layout("Niveaux", y))
+    return fig
+
+
+@lru_cache(maxsize=None)
+def level_hovertemplate(y):
+    # Infobulle générée par Plotly Express pour la colonne y
+    df = pd.DataFrame(columns=["Mission Level", y])
+    return px.bar(df, x="Mission Level", y=y, text=y).data[0].hovertemplate
+
+
+def level_bar_patch(df, y, title):
+    # Mise à jour partielle d'un graphique déjà construit par level_bar :
+    # seules les valeurs de la trace et les titres sont envoyés, le navigateur
+    # garde le reste de la figure (modèle, mise en page, style de la trace)
+    patch = Patch()
+    values = df[y].tolist()
+    trace = patch["data"][0]
+    trace["x"] = df["Mission Level"].tolist()
+    trace["y"] = values
+    trace["text"] = values
+    trace["hovertemplate"] = level_hovertemplate(y)
+    patch["layout"]["title"]["text"] = title
+    patch["layout"]["yaxis"]["title"]["text"] = y
+    return patch
+
+
+def warm_up_figures():
+    # Le premier appel de Plotly Express charge le modèle par défaut, importe
+    # les classes des traces et crée leurs validateurs : on le fait une fois au
+    # démarrage, pour chaque type de graphique du tableau de bord
+    pio.templates[pio.templates.default]
+    df = pd.DataFrame(
+        {
+            "Mission Level": ["mission01", "mission02"],
+            "Score": [1.0, 2.0],
+            "Total": [3, 3],
+            "Player": ["a", "b"],
+        }
+    )
+    group = px.bar(df, x="Mission Level", y=["Score", "Total"], barmode="group", text_auto=True)
+    group.update_traces(marker=dict(line=dict(width=1.5, color="DarkSlateGrey")))
+    box = px.box(df, x="Mission Level", y="Score", points="all", hover_data=["Player"])
+    box.add_scatter(
+        x=df["Mission Level"],
+        y=df["Total"],
+        mode="markers",
+        marker=dict(symbol="star", size=14, color="gold"),
+    )
+    for fig in (level_bar(df, "Score", ""), group, box):
+        fig.update_layout(**figure_layout("", "", legend=dict(orientation="h")))
+        pio.to_json(fig)
+    level_bar_patch(df, "Score", "")
@@ -0,0 +1,26 @@
+import multiprocessing
+import os
+
+# Configuration de gunicorn, lue automatiquement depuis le dossier courant.
+# Les jobs, le cache des statements et les instantanés sont partagés sur
+# disque : une requête peut être traitée par n'importe quel processus.
+bind = os.environ.get("SPY_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("SPY_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# Lu par l'application (taille des pools de cohorte), chargée après ce fichier
+os.environ["SPY_WORKERS"] = str(workers)
+# Les callbacks attendent surtout SQLite et le réseau : plusieurs threads par
+# processus servent les autres utilisateurs pendant ce temps
+threads = int(os.environ.get("SPY_THREADS", 4))
+# L'application (catalogue des niveaux compris) est chargée une fois avant de
+# créer les processus, qui partagent sa mémoire
+preload_app = True
+timeout = 120
+accesslog = "-"
+
+
+def on_starting(server):
+    # Dans le processus maître, avant la création des workers : les
+    # métriques partagées des lancements précédents sont effacées
+    import metrics
+
+    metrics.clear()
@@ -0,0 +1,285 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from statement_store import CACHE_DIR
+
+JOB_WORKERS = 4  # Chargements exécutés en même temps au plus
+JOB_TTL = 10 * 60  # Secondes pendant lesquelles un job terminé reste consultable
+PROGRESS_EVERY = 500  # Statements traités entre deux mises à jour de la progression
+REPORT_INTERVAL = 0.25  # Secondes entre deux enregistrements de la progression
+HEARTBEAT_INTERVAL = 5  # Secondes entre deux signes de vie des jobs d'un processus
+# Un job en attente ou en cours sans signe de vie depuis ce délai est
+# considéré comme perdu (processus arrêté ou recyclé par gunicorn)
+JOB_STALE_AFTER = 60
+JOBS_PATH = os.path.join(CACHE_DIR, "jobs.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    progress TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    finished_at REAL,
+    updated_at REAL
+);
+"""
+
+# État d'un job tel que le lisent les callbacks
+JobInfo = namedtuple(
+    "JobInfo", ["id", "status", "progress", "result", "error", "updated_at"]
+)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobState:
+    # État des jobs enregistré dans SQLite plutôt qu'en mémoire : avec
+    # plusieurs processus (gunicorn), un job lancé par un processus est suivi
+    # ou annulé par des requêtes qui peuvent arriver à un autre
+    def __init__(self, path=JOBS_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            # Base créée avant l'ajout des signes de vie
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if "updated_at" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN updated_at REAL")
+
+    @contextmanager
+    def connection(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create(self, job_id):
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, status, progress, updated_at) "
+                "VALUES (?, 'pending', '{}', ?)",
+                (job_id, time.time()),
+            )
+
+    def update(self, job_id, **fields):
+        # Progression et résultat sont enregistrés en JSON. Chaque mise à jour
+        # vaut signe de vie.
+        fields.setdefault("updated_at", time.time())
+        for key in ("progress", "result"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self.connection() as connection:
+            connection.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+            )
+
+    def load(self, job_id):
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT id, status, progress, result, error, updated_at FROM jobs "
+                "WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, status, progress, result, error, updated_at = row
+        return JobInfo(
+            job_id,
+            status,
+            json.loads(progress),
+            None if result is None else json.loads(result),
+            error,
+            updated_at,
+        )
+
+    def heartbeat(self, job_ids):
+        with self.connection() as connection:
+            connection.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE id IN ({','.join('?' * len(job_ids))})",
+                (time.time(), *job_ids),
+            )
+
+    def cancel(self, job_id):
+        with self.connection() as connection:
+            connection.execute("UPDATE jobs SET cancelled = 1 WHERE id = ?", (job_id,))
+
+    def is_cancelled(self, job_id):
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT cancelled FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def status_counts(self):
+        with self.connection() as connection:
+            return dict(
+                connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            )
+
+    def prune(self, ttl=JOB_TTL):
+        with self.connection() as connection:
+            connection.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (time.time() - ttl,),
+            )
+
+
+class Job:
+    # Job exécuté dans un thread de ce processus
+    def __init__(self, state=None):
+        self.id = uuid.uuid4().hex
+        self.state = state
+        self.progress = {}
+        self.cancel_event = threading.Event()
+        self.reported_at = 0.0
+
+    def report(self, **progress):
+        # Appelé par le traitement : met à jour la progression et interrompt le
+        # job s'il a été annulé, depuis ce processus ou un autre. La base n'est
+        # consultée qu'au plus toutes les REPORT_INTERVAL secondes.
+        self.progress.update(progress)
+        now = time.monotonic()
+        if self.state is not None and now - self.reported_at >= REPORT_INTERVAL:
+            self.reported_at = now
+            self.state.update(self.id, progress=self.progress)
+            if self.state.is_cancelled(self.id):
+                self.cancel_event.set()
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def track(self, iterable, name):
+        # Compte les éléments parcourus et les signale régulièrement
+        count = 0
+        for item in iterable:
+            yield item
+            count += 1
+            if count % PROGRESS_EVERY == 0:
+                self.report(**{name: count})
+        self.report(**{name: count})
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class JobManager:
+    # File de jobs : le chargement tourne hors du thread de la requête Dash,
+    # qui ne fait que consulter son avancement. Le résultat (JSON) est lu
+    # depuis JobState par n'importe quel processus.
+    def __init__(self, workers=JOB_WORKERS, state=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.state = state or JobState()
+        self.jobs = {}  # Jobs en cours dans ce processus
+        self.lock = threading.Lock()
+        self.heartbeat_thread = None
+
+    def submit(self, function, *args):
+        job = Job(self.state)
+        self.state.prune()
+        self.state.create(job.id)
+        with self.lock:
+            self.jobs[job.id] = job
+            if self.heartbeat_thread is None:
+                # Démarré au premier job, dans le processus qui l'exécute
+                # (après le fork des processus gunicorn)
+                self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+                self.heartbeat_thread.start()
+        self.executor.submit(self.run, job, function, *args)
+        return job
+
+    def run(self, job, function, *args):
+        try:
+            if job.cancel_event.is_set() or self.state.is_cancelled(job.id):
+                self.finish(job, "cancelled")
+                return
+            self.state.update(job.id, status="running")
+            try:
+                result = function(job, *args)
+            except JobCancelled:
+                self.finish(job, "cancelled")
+            except Exception as e:
+                self.finish(job, "error", error=str(e))
+            else:
+                self.finish(job, "done", result=result)
+        finally:
+            with self.lock:
+                self.jobs.pop(job.id, None)
+
+    def finish(self, job, status, **fields):
+        self.state.update(
+            job.id, status=status, progress=job.progress, finished_at=time.time(), **fields
+        )
+
+    def heartbeat(self):
+        # Signe de vie des jobs de ce processus, même pendant une étape qui ne
+        # signale pas sa progression (requête lente au LRS, fin du traitement)
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self.lock:
+                job_ids = list(self.jobs)
+            if not job_ids:
+                continue
+            try:
+                self.state.heartbeat(job_ids)
+            except sqlite3.Error as e:
+                print(f"Signe de vie des jobs impossible : {e}")
+
+    def get(self, job_id):
+        job = self.state.load(job_id)
+        if (
+            job is not None
+            and job.status in ("pending", "running")
+            and (job.updated_at is None or time.time() - job.updated_at > JOB_STALE_AFTER)
+        ):
+            # Le processus qui exécutait le job s'est arrêté : le navigateur
+            # cesse d'attendre et affiche une erreur
+            self.state.update(
+                job_id,
+                status="error",
+                error="Job interrompu (processus arrêté)",
+                finished_at=time.time(),
+            )
+            job = self.state.load(job_id)
+        return job
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            job.cancel()
+        self.state.cancel(job_id)
+
+    def status_counts(self):
+        # Nombre de jobs par état : {(("status", état),): nombre}
+        counts = self.state.status_counts()
+        return {
+            (("status", status),): counts.get(status, 0)
+            for status in ("pending", "running", "done", "error", "cancelled")
+        }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
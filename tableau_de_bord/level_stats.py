@@ -0,0 +1,242 @@
+import json
+
+import pandas as pd
+
+from lrs_request import calculate_time_per_level, extract_progress, extract_score
+
+# Position des compteurs dans les statistiques d'un niveau
+STATEMENTS, COMPLETIONS, SCORE_COUNT, SCORE_SUM, SCORE_MAX, SCORE_MIN = range(6)
+
+
+def merge_stats(target, source):
+    for position in (STATEMENTS, COMPLETIONS, SCORE_COUNT, SCORE_SUM):
+        target[position] += source[position]
+    for position, pick in ((SCORE_MAX, max), (SCORE_MIN, min)):
+        values = [v for v in (target[position], source[position]) if v is not None]
+        target[position] = pick(values) if values else None
+
+
+class LevelStatsAccumulator:
+    # Statistiques par (scénario, niveau de mission) mises à jour statement par
+    # statement, sans retraiter l'historique complet
+
+    def __init__(self):
+        self.stats = {}
+        self.last_mission_level = None
+        self.last_scenario = None
+        # Statements les plus récents, comptés avant le premier niveau
+        # rencontré : ils prendront le niveau d'un lot plus récent (prepend)
+        self.pending = [0, 0, 0, 0.0, None, None]
+
+    def add(self, statement):
+        try:
+            score = extract_score(statement)
+            mission_level, scenario = extract_progress(statement)
+        except Exception:
+            return
+
+        # Même report du dernier niveau rencontré que dans process_data
+        if mission_level is None:
+            mission_level, scenario = self.last_mission_level, self.last_scenario
+        else:
+            self.last_mission_level, self.last_scenario = mission_level, scenario
+
+        try:
+            verb = statement["verb"]["id"].split("/")[-1]
+        except Exception:
+            return
+
+        if mission_level is None:
+            # Aucun niveau avant ce statement : en attente, hors des statistiques
+            stats = self.pending
+        else:
+            stats = self.stats.get((scenario, mission_level))
+            if stats is None:
+                stats = [0, 0, 0, 0.0, None, None]
+                self.stats[(scenario, mission_level)] = stats
+        stats[STATEMENTS] += 1
+        if verb == "completed":
+            stats[COMPLETIONS] += 1
+        if score is not None:
+            stats[SCORE_COUNT] += 1
+            stats[SCORE_SUM] += score
+            if stats[SCORE_MAX] is None or score > stats[SCORE_MAX]:
+                stats[SCORE_MAX] = score
+            if stats[SCORE_MIN] is None or score < stats[SCORE_MIN]:
+                stats[SCORE_MIN] = score
+
+    def update(self, statements):
+        for statement in statements:
+            self.add(statement)
+        return self
+
+    def merge(self, other):
+        # Additionne les statistiques d'un autre accumulateur (ex : cohorte)
+        for key, other_stats in other.stats.items():
+            if key in self.stats:
+                merge_stats(self.stats[key], other_stats)
+            else:
+                self.stats[key] = list(other_stats)
+        return self
+
+    def prepend(self, newer):
+        # Ajoute les statistiques de statements plus récents que ceux déjà
+        # comptés (synchronisation incrémentale), comme un passage complet du
+        # plus récent au plus ancien : les statements en attente prennent le
+        # niveau du plus ancien statement avec niveau du lot récent
+        pending = self.pending
+        self.merge(newer)
+        self.pending = list(newer.pending)
+        if newer.last_mission_level is None:
+            # Le lot récent n'a aucun niveau : tout reste en attente
+            merge_stats(self.pending, pending)
+        elif pending[STATEMENTS]:
+            key = (newer.last_scenario, newer.last_mission_level)
+            if key in self.stats:
+                merge_stats(self.stats[key], pending)
+            else:
+                self.stats[key] = list(pending)
+        if self.last_mission_level is None:
+            self.last_mission_level = newer.last_mission_level
+            self.last_scenario = newer.last_scenario
+        return self
+
+    @classmethod
+    def combine(cls, accumulators):
+        result = cls()
+        for accumulator in accumulators:
+            result.merge(accumulator)
+        return result
+
+    def by_level(self, scenario=None):
+        # Regroupe les statistiques par niveau, pour un scénario ou pour tous
+        levels = {}
+        for (stats_scenario, mission_level), stats in self.stats.items():
+            if scenario is not None and stats_scenario != scenario:
+                continue
+            if mission_level in levels:
+                merge_stats(levels[mission_level], stats)
+            else:
+                levels[mission_level] = list(stats)
+        return levels
+
+    def completed_counts(self, scenario=None):
+        return {
+            level: stats[COMPLETIONS]
+            for level, stats in self.by_level(scenario).items()
+            if stats[COMPLETIONS] > 0
+        }
+
+    def avg_score_by_level(self, scenario=None):
+        return {
+            level: round(stats[SCORE_SUM] / stats[SCORE_COUNT])
+            if stats[SCORE_COUNT] > 0
+            else None
+            for level, stats in self.by_level(scenario).items()
+        }
+
+    def max_score_by_level(self, scenario=None):
+        return {
+            level: stats[SCORE_MAX] for level, stats in self.by_level(scenario).items()
+        }
+
+    def min_score_by_level(self, scenario=None):
+        return {
+            level: stats[SCORE_MIN] for level, stats in self.by_level(scenario).items()
+        }
+
+    def to_dict(self):
+        return {
+            "stats": [
+                [scenario, level, stats] for (scenario, level), stats in self.stats.items()
+            ],
+            "last_mission_level": self.last_mission_level,
+            "last_scenario": self.last_scenario,
+            "pending": self.pending,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        accumulator = cls()
+        accumulator.stats = {
+            (scenario, level): list(stats) for scenario, level, stats in data["stats"]
+        }
+        accumulator.last_mission_level = data.get("last_mission_level")
+        accumulator.last_scenario = data.get("last_scenario")
+        accumulator.pending = list(data.get("pending", accumulator.pending))
+        return accumulator
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, payload):
+        return cls.from_dict(json.loads(payload))
+
+
+def level_entry(stats):
+    # Statistiques d'un niveau à partir des compteurs de LevelStatsAccumulator
+    # (ou d'une ligne dans le même ordre)
+    has_score = stats[SCORE_COUNT] > 0
+    return {
+        "statements": int(stats[STATEMENTS]),
+        "completions": int(stats[COMPLETIONS]),
+        "score_count": int(stats[SCORE_COUNT]),
+        "avg_score": (
+            round(float(stats[SCORE_SUM]) / stats[SCORE_COUNT]) if has_score else None
+        ),
+        "max_score": float(stats[SCORE_MAX]) if has_score else None,
+        "min_score": float(stats[SCORE_MIN]) if has_score else None,
+    }
+
+
+def build_level_cube(df, accumulator=None):
+    # Agrégats par scénario et par niveau calculés une fois au chargement des
+    # données : {scénario: {niveau: statistiques}}. Changer de scénario dans le
+    # tableau de bord revient alors à une simple lecture de dictionnaire.
+    # process_data reporte niveau et scénario sur les statements qui n'en ont
+    # pas : les statistiques sont celles de LevelStatsAccumulator. Avec
+    # accumulator (tenu à jour par sync_aggregates), seuls les temps passés
+    # sont calculés sur la table.
+    scoped = df.dropna(subset=["Scenario", "Mission Level"])
+    if accumulator is None:
+        scoped = scoped.assign(
+            Completed=lambda frame: frame["Verb"] == "completed",
+            # Scores en float32 dans le schéma, sommés en float64
+            Score=lambda frame: frame["Score"].astype(float),
+        )
+        stats = scoped.groupby(["Scenario", "Mission Level"], observed=True).agg(
+            # Nombre de statements sur le niveau (pas de tentatives : une
+            # tentative compte plusieurs statements)
+            statements=("Verb", "size"),
+            completions=("Completed", "sum"),
+            score_count=("Score", "count"),
+            score_sum=("Score", "sum"),
+            score_max=("Score", "max"),
+            score_min=("Score", "min"),
+        )
+        levels = [(key, list(row)) for key, row in zip(stats.index, stats.to_numpy())]
+    else:
+        # Même ordre que le groupby : scénarios puis niveaux triés
+        levels = sorted(
+            (key, stats) for key, stats in accumulator.stats.items() if key[0] is not None
+        )
+
+    cube = {}
+    for (scenario, level), stats in levels:
+        cube.setdefault(scenario, {})[level] = {
+            **level_entry(stats),
+            "time_max": None,
+            "time_min": None,
+            "time_avg": None,
+        }
+
+    # Temps passé par niveau, calculé séparément pour chaque scénario
+    for scenario, group in scoped.groupby("Scenario", sort=False, observed=True):
+        time_spent = calculate_time_per_level(group)
+        scenario_levels = cube.get(scenario, {})
+        for key, values in zip(("time_max", "time_min", "time_avg"), time_spent):
+            for level, value in values.items():
+                if pd.notna(value) and level in scenario_levels:
+                    scenario_levels[level][key] = float(value)
+    return cube
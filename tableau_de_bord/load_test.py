@@ -0,0 +1,277 @@
+import argparse
+import random
+import threading
+import time
+
+import requests
+
+# Test de charge : des utilisateurs simulés ouvrent la page, chargent un
+# joueur, attendent la fin du job puis affichent les graphiques de chaque
+# scénario, comme une classe entière connectée en même temps. À lancer contre
+# un serveur démarré avec le LRS local (voir README) :
+#   python load_test.py --url http://127.0.0.1:8050 --users 30 --duration 60
+
+POLL_INTERVAL = 0.5  # Comme dcc.Interval(id="job-poll")
+TIME_SPENT = [
+    "Temps passé maximum par niveau",
+    "Temps passé minimum par niveau",
+    "Temps moyen passé par niveau",
+]
+MAX_SCENARIOS = 2  # Scénarios affichés par chaque utilisateur
+PERIOD = "Tout l'historique"  # Période demandée (tableau_final.PERIODS)
+
+# Callbacks des graphiques du joueur : (sortie, dépend du scénario). Ceux
+# qui dépendent du scénario renvoient aussi l'état "-drawn" du graphique :
+# une fois construit, ils n'envoient plus que des mises à jour partielles.
+FIGURES = [
+    ("graph-avg-score", True),
+    ("graph-max-score", True),
+    ("graph-completed-counts", True),
+    ("graph-time-spent", True),
+    ("graph-player-stars", False),
+    ("graph-total-stars", False),
+]
+SCENARIO_OUTPUTS = [
+    ("menu-deroulant-scenario", "options"),
+    ("data-store", "data"),
+    ("lrs-status", "children"),
+    ("job-progress", "children"),
+    ("job-poll", "disabled"),
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}  # {type de requête: [secondes]}
+        self.wire_bytes = 0
+        self.body_bytes = 0
+        self.errors = 0
+        self.sessions = 0
+
+    def record(self, kind, elapsed, response):
+        with self.lock:
+            self.latencies.setdefault(kind, []).append(elapsed)
+            # Content-Length : taille transmise, compressée ou non
+            self.wire_bytes += int(response.headers.get("Content-Length", len(response.content)))
+            self.body_bytes += len(response.content)
+            if response.status_code >= 400:
+                self.errors += 1
+
+
+def prop(id, property, value):
+    return {"id": id, "property": property, "value": value}
+
+
+def callback_payload(outputs, inputs, state=()):
+    # Corps d'une requête /_dash-update-component, comme l'envoie le navigateur
+    outputs = [{"id": id, "property": property} for id, property in outputs]
+    if len(outputs) == 1:
+        output = f"{outputs[0]['id']}.{outputs[0]['property']}"
+        outputs = outputs[0]
+    else:
+        output = "..{}..".format("...".join(f"{o['id']}.{o['property']}" for o in outputs))
+    return {
+        "output": output,
+        "outputs": outputs,
+        "inputs": list(inputs),
+        "state": list(state),
+        "changedPropIds": [f"{inputs[0]['id']}.{inputs[0]['property']}"],
+    }
+
+
+class User:
+    def __init__(self, url, results, players, compression, seed, period=PERIOD):
+        self.url = url.rstrip("/")
+        self.period = period
+        self.results = results
+        self.players = players
+        self.random = random.Random(seed)
+        self.session = requests.Session()
+        self.drawn = {}  # État "-drawn" des graphiques, gardé par le navigateur
+        if not compression:
+            self.session.headers["Accept-Encoding"] = "identity"
+
+    def request(self, kind, method, path, **kwargs):
+        start = time.perf_counter()
+        response = self.session.request(method, self.url + path, timeout=120, **kwargs)
+        self.results.record(kind, time.perf_counter() - start, response)
+        response.raise_for_status()
+        return response
+
+    def callback(self, kind, payload):
+        response = self.request("callback:" + kind, "POST", "/_dash-update-component", json=payload)
+        if response.status_code == 204:
+            return {}
+        return response.json()["response"]
+
+    def open_page(self):
+        self.drawn = {}
+        for path in ("/", "/_dash-layout", "/_dash-dependencies"):
+            self.request("page", "GET", path)
+
+    def load_player(self, username, deadline):
+        job_data = self.callback(
+            "submit",
+            callback_payload(
+                [("job-store", "data")],
+                [
+                    prop("submit-button", "n_clicks", 1),
+                    prop("menu-deroulant-periode", "value", self.period),
+                ],
+                [prop("username-input", "value", username), prop("job-store", "data", None)],
+            ),
+        )["job-store"]["data"]
+        n_intervals = 0
+        while time.monotonic() < deadline:
+            response = self.callback(
+                "poll",
+                callback_payload(
+                    SCENARIO_OUTPUTS,
+                    [
+                        prop("job-poll", "n_intervals", n_intervals),
+                        prop("job-store", "data", job_data),
+                    ],
+                ),
+            )
+            if response.get("job-poll", {}).get("disabled"):
+                return (
+                    response["menu-deroulant-scenario"]["options"],
+                    response["data-store"]["data"],
+                )
+            n_intervals += 1
+            time.sleep(POLL_INTERVAL)
+        return [], None
+
+    def level_figure(self, figure, inputs, state):
+        drawn = self.drawn.get(figure)
+        response = self.callback(
+            "figure" if drawn is None else "figure:patch",
+            callback_payload(
+                [(figure, "figure"), (f"{figure}-drawn", "data")],
+                inputs,
+                state + [prop(f"{figure}-drawn", "data", drawn)],
+            ),
+        )
+        self.drawn[figure] = response[f"{figure}-drawn"]["data"]
+
+    def show_figures(self, username, options, data):
+        state = [prop("username-input", "value", username)]
+        for figure, per_scenario in FIGURES:
+            if per_scenario:
+                continue
+            self.callback(
+                "figure",
+                callback_payload([(figure, "figure")], [prop("data-store", "data", data)], state),
+            )
+        for option in options[:MAX_SCENARIOS]:
+            scenario = prop("menu-deroulant-scenario", "value", option["value"])
+            for figure, per_scenario in FIGURES:
+                if not per_scenario:
+                    continue
+                inputs = [scenario, prop("data-store", "data", data)]
+                if figure == "graph-time-spent":
+                    inputs.insert(1, prop("menu-deroulant-time-spent", "value", TIME_SPENT[0]))
+                self.level_figure(figure, inputs, state)
+            # Changement du type de temps passé : seul ce graphique est mis à jour
+            for time_spent in TIME_SPENT[1:]:
+                self.level_figure(
+                    "graph-time-spent",
+                    [
+                        scenario,
+                        prop("menu-deroulant-time-spent", "value", time_spent),
+                        prop("data-store", "data", data),
+                    ],
+                    state,
+                )
+
+    def run(self, deadline):
+        while time.monotonic() < deadline:
+            username = f"Joueur{self.random.randrange(self.players):03d}"
+            try:
+                self.open_page()
+                options, data = self.load_player(username, deadline)
+                if data is None:
+                    continue
+                self.show_figures(username, options, data)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                print(f"{username} : {e}")
+                continue
+            with self.results.lock:
+                self.results.sessions += 1
+
+
+def run_load_test(
+    url, users, duration, players, compression=True, ramp_up=5.0, period=PERIOD
+):
+    results = Results()
+    deadline = time.monotonic() + duration
+    threads = []
+    for i in range(users):
+        user = User(url, results, players, compression, seed=i, period=period)
+        thread = threading.Thread(target=user.run, args=(deadline,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        # Les utilisateurs arrivent progressivement, comme en début de séance
+        time.sleep(ramp_up / users)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def report(results, duration):
+    total = sum(len(values) for values in results.latencies.values())
+    print(f"{total} requête(s) en {duration:.0f} s : {total / duration:.1f} requêtes/s")
+    print(
+        f"{results.sessions} parcours complet(s) : {results.sessions / duration * 60:.1f} "
+        f"utilisateurs servis/min, {results.errors} erreur(s)"
+    )
+    if results.body_bytes:
+        print(
+            f"Données transmises : {results.wire_bytes / 1024**2:.1f} Mio "
+            f"({results.body_bytes / 1024**2:.1f} Mio décompressés, "
+            f"{results.wire_bytes / results.body_bytes:.0%})"
+        )
+    print(f"{'requête':<20}{'nombre':>8}{'p50 (ms)':>10}{'p95 (ms)':>10}{'max (ms)':>10}")
+    for kind, values in sorted(results.latencies.items()):
+        print(
+            f"{kind:<20}{len(values):>8}{percentile(values, 0.5) * 1000:>10.0f}"
+            f"{percentile(values, 0.95) * 1000:>10.0f}{max(values) * 1000:>10.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du tableau de bord")
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--users", type=int, default=30, help="Utilisateurs simultanés")
+    parser.add_argument("--duration", type=float, default=60.0, help="Secondes")
+    parser.add_argument("--players", type=int, default=20, help="Joueurs différents demandés")
+    parser.add_argument(
+        "--no-compression",
+        action="store_true",
+        help="Demander des réponses non compressées (Accept-Encoding: identity)",
+    )
+    parser.add_argument("--period", default=PERIOD, help="Période demandée par les utilisateurs")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    results = run_load_test(
+        args.url,
+        args.users,
+        args.duration,
+        args.players,
+        not args.no_compression,
+        period=args.period,
+    )
+    report(results, time.monotonic() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Configuration par défaut du LRS, modifiable avec les variables
+# d'environnement SPY_LRS_ENDPOINT, SPY_LRS_USER et SPY_LRS_PASSWORD (par
+# exemple pour utiliser le LRS local de mock_lrs.py)
+ENDPOINT = os.environ.get(
+    "SPY_LRS_ENDPOINT", "https://lrsels.lip6.fr/data/xAPI/statements"
+)
+HEADERS = {"X-Experience-API-Version": "1.0.3"}
+AUTH = (
+    os.environ.get("SPY_LRS_USER", "9fe9fa9a494f2b34b3cf355dcf20219d7be35b14"),
+    os.environ.get("SPY_LRS_PASSWORD", "b547a66817be9c2dbad2a5f583e704397c9db809"),
+)
+
+TIMEOUT = (5, 30)  # (connexion, lecture) en secondes
+POOL_SIZE = 10  # Connexions gardées ouvertes vers le LRS
+HOST_CONCURRENCY = 8  # Requêtes simultanées au plus vers le LRS
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5  # Délai de base entre deux tentatives, doublé à chaque essai
+BACKOFF_MAX = 10
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+FAILURE_THRESHOLD = 5  # Échecs consécutifs avant d'ouvrir le disjoncteur
+RESET_TIMEOUT = 30  # Secondes avant de retenter une requête vers le LRS
+
+
+class LRSError(Exception):
+    pass
+
+
+class LRSUnavailableError(LRSError):
+    # Levée sans contacter le LRS quand le disjoncteur est ouvert
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                # Une seule requête d'essai à la fois tant que le LRS n'a pas répondu
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class LRSClient:
+    def __init__(
+        self,
+        endpoint=ENDPOINT,
+        headers=HEADERS,
+        auth=AUTH,
+        timeout=TIMEOUT,
+        pool_size=POOL_SIZE,
+        max_concurrency=HOST_CONCURRENCY,
+        max_retries=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        breaker=None,
+    ):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.breaker = breaker or CircuitBreaker()
+        # Toutes les requêtes du client vont vers le même hôte : le sémaphore
+        # limite la charge imposée au LRS quel que soit le nombre de threads
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+
+        # La session garde les connexions TCP/TLS ouvertes entre deux requêtes
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.auth = auth
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def resolve(self, more):
+        # Les liens "more" sont relatifs à la racine du LRS
+        return urljoin(self.endpoint, more)
+
+    def backoff(self, attempt, response=None):
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(int(response.headers["Retry-After"]), BACKOFF_MAX)
+        delay = min(self.backoff_factor * 2**attempt, BACKOFF_MAX)
+        return delay * random.uniform(0.5, 1)
+
+    def get(self, url=None, params=None):
+        if not self.breaker.allow():
+            raise LRSUnavailableError("LRS indisponible, nouvel essai plus tard")
+
+        url = url or self.endpoint
+        try:
+            for attempt in range(self.max_retries + 1):
+                response = None
+                try:
+                    with self.semaphore, metrics.measure("lrs_request"):
+                        response = self.session.get(
+                            url, params=params, timeout=self.timeout
+                        )
+                except requests.RequestException as e:
+                    # Connexion, délai dépassé, réponse tronquée...
+                    metrics.increment("spy_lrs_requests_total", status="error")
+                    error = f"Error fetching data: {e}"
+                else:
+                    metrics.increment("spy_lrs_requests_total", status=response.status_code)
+                    metrics.increment("spy_lrs_bytes_fetched_total", len(response.content))
+                    if response.status_code == 200:
+                        try:
+                            page = response.json()
+                        except ValueError as e:
+                            # Corps tronqué ou invalide : réessayé comme une
+                            # erreur de connexion
+                            error = f"Error decoding data: {e}"
+                        else:
+                            self.breaker.record_success()
+                            return page
+                    else:
+                        error = f"Error fetching data: {response.status_code}, {response.text}"
+                        if response.status_code not in RETRY_STATUSES:
+                            # Erreur côté requête : le LRS répond, inutile de réessayer
+                            self.breaker.record_success()
+                            raise LRSError(error)
+
+                if attempt < self.max_retries:
+                    time.sleep(self.backoff(attempt, response))
+        except LRSError:
+            raise
+        except BaseException:
+            # Toute autre erreur (interruption...) compte comme un échec : sinon
+            # la requête d'essai du disjoncteur ne serait jamais libérée
+            self.breaker.record_failure()
+            raise
+
+        self.breaker.record_failure()
+        raise LRSError(error)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # Client partagé par tous les callbacks du tableau de bord
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LRSClient()
+        return _client
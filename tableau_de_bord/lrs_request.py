@@ -1,222 +1,397 @@
-import requests
+import numpy as np
 import pandas as pd
 import dash
 import json
+import os
 from dash import dcc, html, dash_table
 from dash.dependencies import Input, Output, State
 import plotly.express as px
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lrs_client import get_client
+from schema import MISSING_TIMESTAMP, in_window, timestamp_ticks, to_compact, to_epoch_ns
+import metrics
 
 warnings.filterwarnings("ignore", message=".*NotOpenSSLWarning.*")
 
-ENDPOINT = "https://lrsels.lip6.fr/data/xAPI/statements"
-HEADERS = {"X-Experience-API-Version": "1.0.3"}
-AUTH = (
-    "9fe9fa9a494f2b34b3cf355dcf20219d7be35b14",
-    "b547a66817be9c2dbad2a5f583e704397c9db809",
-)
 NAME = "59F2BF0"
-
-
-def fetch_lrs_data(agent_name):
+PAGE_SIZE = 500  # Nombre de statements demandés par page
+MAX_WORKERS = 16  # Joueurs récupérés en parallèle par fetch_many
+# Les statements reçus ne gardent que les champs lus par le tableau de bord
+# (voir project_statement). SPY_PROJECT_STATEMENTS=0 garde les statements
+# complets, par exemple pour les exporter.
+PROJECT_STATEMENTS = os.environ.get("SPY_PROJECT_STATEMENTS", "1") != "0"
+
+SCORE_EXTENSION = "https://spy.lip6.fr/xapi/extensions/score"
+PROGRESS_EXTENSION = "https://w3id.org/xapi/seriousgames/extensions/progress"
+CONTEXT_EXTENSION = "https://spy.lip6.fr/xapi/extensions/context"
+MIN_ELAPSED = 0.05  # Durées ignorées en dessous de 3 secondes (en minutes)
+MIN_THRESHOLD = 0.01  # Seuil minimal pour le temps minimum (en minutes)
+MAX_DURATION = 24 * 60  # Au-delà de 24 heures, le niveau est une anomalie
+COLUMNS = ["Timestamp", "Verb", "Actor", "Object", "Score", "Mission Level", "Scenario"]
+
+
+def select_keys(mapping, keys):
+    # Copie de mapping réduite à keys ; TypeError si ce n'est pas un objet JSON
+    if not isinstance(mapping, dict):
+        raise TypeError(mapping)
+    selected = {}
+    for key in keys:
+        if key in mapping:
+            selected[key] = mapping[key]
+    return selected
+
+
+def project_statement(statement):
+    # Copie du statement réduite aux champs lus par process_data,
+    # LevelStatsAccumulator et le cache local (id, dates, verbe, nom du joueur,
+    # activité, score et extensions de progression). L'API xAPI ne permet pas
+    # de choisir les champs renvoyés : format=ids retire la définition de
+    # l'activité, donc les extensions de niveau et de scénario, et
+    # format=canonical la remplace par la définition enregistrée par le LRS,
+    # commune à tous les niveaux. La réduction se fait donc à la réception.
+    # Un statement de forme inattendue est gardé tel quel.
+    try:
+        projected = select_keys(statement, ("id", "timestamp", "stored"))
+        if "verb" in statement:
+            projected["verb"] = select_keys(statement["verb"], ("id",))
+        if "actor" in statement:
+            actor = statement["actor"]
+            projected["actor"] = select_keys(actor, ("name",))
+            if "account" in actor:
+                projected["actor"]["account"] = select_keys(actor["account"], ("name",))
+        if "object" in statement:
+            activity = statement["object"]
+            projected["object"] = select_keys(activity, ("id",))
+            if "definition" in activity:
+                definition = activity["definition"]
+                projected["object"]["definition"] = select_keys(definition, ())
+                if "extensions" in definition:
+                    projected["object"]["definition"]["extensions"] = select_keys(
+                        definition["extensions"], (PROGRESS_EXTENSION, CONTEXT_EXTENSION)
+                    )
+        if "result" in statement:
+            result = statement["result"]
+            projected["result"] = select_keys(result, ("success",))
+            if "extensions" in result:
+                projected["result"]["extensions"] = select_keys(
+                    result["extensions"], (SCORE_EXTENSION,)
+                )
+    except TypeError:
+        return statement
+    return projected
+
+
+def iter_lrs_statements(
+    agent_name,
+    page_size=PAGE_SIZE,
+    max_statements=None,
+    since=None,
+    client=None,
+    on_page=None,
+    until=None,
+    verb=None,
+    activity=None,
+    related_activities=False,
+    project=PROJECT_STATEMENTS,
+):
+    # Parcourt toutes les pages du LRS en suivant le lien "more" et renvoie
+    # les statements au fur et à mesure, sans garder les pages en mémoire.
+    # on_page(pages, statements) est appelé après chaque page reçue.
+    # verb et activity filtrent côté LRS. Le tableau de bord ne les utilise
+    # pas : les niveaux sont reportés depuis les statements précédents et le
+    # temps passé compte tous les verbes.
+    client = client or get_client()
     agent = {"account": {"homePage": "https://www.lip6.fr/mocah/", "name": agent_name}}
+    url = client.endpoint
     params = {
         "agent": json.dumps(agent),  # Convertir l'objet Python en JSON
-        "limit": 500,
+        "limit": page_size,
     }
-    response = requests.get(ENDPOINT, headers=HEADERS, auth=AUTH, params=params)
-    if response.status_code == 200:
-        return response.json()["statements"]
-    else:
-        raise Exception(f"Error fetching data: {response.status_code}, {response.text}")
-
+    if since is not None:
+        # Seulement les statements enregistrés par le LRS après cette date
+        params["since"] = since
+    if until is not None:
+        # Jusqu'à cette date d'enregistrement incluse
+        params["until"] = until
+    if verb is not None:
+        params["verb"] = verb
+    if activity is not None:
+        params["activity"] = activity
+        if related_activities:
+            # Aussi les statements dont le contexte cite l'activité
+            params["related_activities"] = "true"
+    if max_statements is not None:
+        # Pas besoin de demander une page plus grande que le budget
+        params["limit"] = min(page_size, max_statements)
+    count = 0
+    pages = 0
+    while url and (max_statements is None or count < max_statements):
+        page = client.get(url, params=params)
+        pages += 1
+        if on_page is not None:
+            on_page(pages, count + len(page.get("statements", [])))
+        for statement in page.get("statements", []):
+            yield project_statement(statement) if project else statement
+            count += 1
+            if max_statements is not None and count >= max_statements:
+                return
+
+        # Le lien "more" contient déjà les paramètres de la requête
+        more = page.get("more")
+        url = client.resolve(more) if more else None
+        params = None
+
+
+def fetch_lrs_data(
+    agent_name, page_size=PAGE_SIZE, max_statements=None, client=None, **filters
+):
+    # filters : since, until, verb, activity... (voir iter_lrs_statements)
+    return list(
+        iter_lrs_statements(agent_name, page_size, max_statements, client=client, **filters)
+    )
 
-def process_data(data):
-    records = []
-    last_mission_level = None
-    all_mission_levels = set()
-    completed_counts = {}
-    score_by_level = {}
 
+def fetch_many(
+    agent_names, max_workers=MAX_WORKERS, client=None, fetch=None, on_done=None, **kwargs
+):
+    # Récupère les statements de plusieurs joueurs en parallèle. Le nombre de
+    # requêtes simultanées vers le LRS reste borné par le client. fetch
+    # (fetch_lrs_data par défaut, StatementStore.sync_aggregates pour une
+    # cohorte) est appelé pour chaque joueur, on_done(joueurs terminés) après
+    # chacun.
+    client = client or get_client()
+    fetch = fetch or fetch_lrs_data
+    agent_names = list(dict.fromkeys(agent_names))
+    results = {}
+    errors = {}
+    if not agent_names:
+        return results, errors
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(agent_names))) as pool:
+        futures = {
+            pool.submit(fetch, agent_name, client=client, **kwargs): agent_name
+            for agent_name in agent_names
+        }
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                agent_name = futures[future]
+                try:
+                    results[agent_name] = future.result()
+                except Exception as e:
+                    errors[agent_name] = e
+                if on_done is not None:
+                    on_done(done)
+        except BaseException:
+            # Annulation (job interrompu) : les joueurs pas encore commencés
+            # ne sont pas récupérés
+            for future in futures:
+                future.cancel()
+            raise
+    # Même ordre que la liste donnée
+    results = {name: results[name] for name in agent_names if name in results}
+    return results, errors
+
+
+def extract_score(statement):
+    success = statement.get("result", {}).get("success", False)
+    score = statement.get("result", {}).get("extensions", {}).get(SCORE_EXTENSION, None)
+
+    if not success:
+        score = None
+
+    if score:
+        if isinstance(score, list) and len(score) > 0:
+            score = score[0]
+
+        if isinstance(score, str):
+            score = float(score)
+
+        if isinstance(score, (int, float)):
+            score = float(score)
+        else:
+            score = None
+    else:
+        score = None
+    return score
+
+
+def extract_progress(statement):
+    # Renvoie le niveau de mission et le scénario indiqués dans les extensions
+    mission_level = None
+    scenario = None
+    definition = statement.get("object", {}).get("definition", {})
+    if "extensions" in definition:
+        extensions = definition["extensions"]
+        if PROGRESS_EXTENSION in extensions:
+            mission_level = extensions[PROGRESS_EXTENSION][0]
+        if CONTEXT_EXTENSION in extensions:
+            scenario = extensions[CONTEXT_EXTENSION][0]
+    return mission_level, scenario
+
+
+@metrics.timed("process_data")
+def process_data(data, since=None, until=None):
+    # Extraction en colonnes en un seul passage sur les statements. La table
+    # renvoyée suit le schéma compact décrit dans schema.py. Avec since et/ou
+    # until (dates ISO 8601), seuls les statements datés de cette période sont
+    # comptés et renvoyés.
+    columns = {column: [] for column in COLUMNS}
+    valid = []
     for statement in data:
         try:
-            success = statement.get("result", {}).get("success", False)
-            score = (
-                statement.get("result", {})
-                .get("extensions", {})
-                .get("https://spy.lip6.fr/xapi/extensions/score", None)
-            )
-
-            if not success:
-                score = None
-
-            if score:
-                if isinstance(score, list) and len(score) > 0:
-                    score = score[0]
-
-                if isinstance(score, str):
-                    score = float(score)
-
-                if isinstance(score, (int, float)):
-                    score = float(score)
-                else:
-                    score = None
-            else:
-                score = None
-
-            mission_level = None
-            scenario = None
-            if "object" in statement:
-                object_data = statement["object"]
-                if "definition" in object_data:
-                    definition = object_data["definition"]
-                    if "extensions" in definition:
-                        extensions = definition["extensions"]
-                        if (
-                            "https://w3id.org/xapi/seriousgames/extensions/progress"
-                            in extensions
-                        ):
-                            mission_level = extensions[
-                                "https://w3id.org/xapi/seriousgames/extensions/progress"
-                            ][0]
-                        if "https://spy.lip6.fr/xapi/extensions/context" in extensions:
-                            scenario = extensions[
-                                "https://spy.lip6.fr/xapi/extensions/context"
-                            ][0]
-
-            if mission_level is None and last_mission_level is not None:
-                mission_level = last_mission_level
-
-            if mission_level is not None:
-                last_mission_level = mission_level
-                all_mission_levels.add(mission_level)
-
-                verb = statement["verb"]["id"].split("/")[-1]
-                if verb == "completed":
-                    if mission_level not in completed_counts:
-                        completed_counts[mission_level] = 0
-                    completed_counts[mission_level] += 1
-
-                if mission_level not in score_by_level:
-                    score_by_level[mission_level] = []
-                if score is not None:
-                    score_by_level[mission_level].append(score)
-
-            records.append(
-                {
-                    "Timestamp": statement.get("timestamp"),
-                    "Verb": statement["verb"]["id"].split("/")[-1],
-                    "Actor": statement["actor"].get("name", "Unknown"),
-                    "Object": statement["object"].get("id", "Unknown"),
-                    "Score": score,
-                    "Mission Level": mission_level,
-                    "Scenario": scenario,
-                }
-            )
-        except Exception as e:
+            score = extract_score(statement)
+            mission_level, scenario = extract_progress(statement)
+        except Exception:
             continue
 
-        avg_score_by_level = {
-            level: round(sum(scores) / len(scores)) if len(scores) > 0 else None
-            for level, scores in score_by_level.items()
-        }
-        max_score_by_level = {
-            level: max(scores) if len(scores) > 0 else None
-            for level, scores in score_by_level.items()
-        }
+        # Un statement mal formé garde son niveau pour le report sur les
+        # statements suivants mais n'est pas compté
+        try:
+            verb = statement["verb"]["id"].split("/")[-1]
+        except Exception:
+            verb = None
+        try:
+            actor = statement["actor"].get("name", "Unknown")
+            object_id = statement["object"].get("id", "Unknown")
+        except Exception:
+            actor = object_id = None
+            valid.append(False)
+        else:
+            valid.append(verb is not None)
+
+        columns["Timestamp"].append(statement.get("timestamp"))
+        columns["Verb"].append(verb)
+        columns["Actor"].append(actor)
+        columns["Object"].append(object_id)
+        columns["Score"].append(score)
+        columns["Mission Level"].append(mission_level)
+        columns["Scenario"].append(scenario)
+
+    metrics.increment("spy_statements_processed_total", len(valid))
+    frame = pd.DataFrame(columns, columns=COLUMNS)
+    frame["Timestamp"] = to_epoch_ns(frame["Timestamp"])
+    frame["Score"] = frame["Score"].astype(float)
+    # Les statements sans niveau reprennent le dernier niveau rencontré et son
+    # scénario, comme LevelStatsAccumulator
+    # scénario (même absent), comme LevelStatsAccumulator
+    has_level = frame["Mission Level"].notna().to_numpy()
+    frame["Mission Level"] = frame["Mission Level"].ffill()
+    source = np.maximum.accumulate(np.where(has_level, np.arange(len(frame)), -1))
+    codes, scenarios = pd.factorize(frame["Scenario"], sort=True)
+    frame["Scenario"] = pd.Categorical.from_codes(
+        np.where(source >= 0, codes[source], -1), scenarios
+    )
 
-    df = pd.DataFrame(records)
-    df["Timestamp"] = pd.to_datetime(df["Timestamp"])
-    print(df)
+    # Période demandée : appliquée après le report des niveaux, pour que les
+    # statements hors période transmettent encore leur niveau
+    in_period = np.ones(len(frame), dtype=bool)
+    if since is not None or until is not None:
+        timestamps = frame["Timestamp"].to_numpy()
+        in_period = (timestamps != MISSING_TIMESTAMP) & in_window(
+            timestamps, since=since, until=until
+        )
+
+    levels = frame["Mission Level"]
+    all_mission_levels = list(levels[in_period].dropna().unique())
+
+    # Agrégats par niveau calculés une seule fois sur la période
+    counted = frame[frame["Verb"].notna() & levels.notna() & in_period]
+    completed_counts = {
+        level: int(count)
+        for level, count in counted[counted["Verb"] == "completed"]
+        .groupby("Mission Level", sort=False)
+        .size()
+        .items()
+    }
+    score_stats = counted.groupby("Mission Level", sort=False)["Score"].agg(
+        ["sum", "count", "max"]
+    )
+    avg_score_by_level = {
+        level: round(float(row["sum"]) / row["count"]) if row["count"] > 0 else None
+        for level, row in score_stats.iterrows()
+    }
+    max_score_by_level = {
+        level: float(row["max"]) if row["count"] > 0 else None
+        for level, row in score_stats.iterrows()
+    }
+
+    df = to_compact(
+        frame[np.array(valid, dtype=bool) & in_period].reset_index(drop=True)
+    )
     return (
         df,
-        list(all_mission_levels),
+        all_mission_levels,
         completed_counts,
         avg_score_by_level,
         max_score_by_level,
     )
 
 
-def calculate_time_per_level(df):
+@metrics.timed("calculate_time_per_level")
+def calculate_time_per_level(
+    df,
+    min_elapsed=MIN_ELAPSED,
+    min_threshold=MIN_THRESHOLD,
+    max_duration=MAX_DURATION,
+    since=None,
+    until=None,
+):
+    if since is not None or until is not None:
+        # Même période que process_data, si la table couvre un historique plus long
+        ticks, nanoseconds_per_tick, has_time = timestamp_ticks(df["Timestamp"])
+        df = df[has_time & in_window(ticks, nanoseconds_per_tick, since, until)]
     if df["Mission Level"].isnull().all():
         # print("Aucun niveau détecté dans les données.")
-        return pd.DataFrame(columns=["Mission Level", "Time Spent (min)"])
-
-    # Fonction pour convertir les timestamps en minutes écoulées
-    def timestamps_to_minutes(group):
-        base_time = group.min()  # Prend le premier Timestamp (le plus petit)
-        return (group - base_time).dt.total_seconds() / 60  # Convertit en minutes
-
-    # Regrouper par "Mission Level" et calculer la liste de minutes écoulées
-    minutes_per_level = (
-        df.dropna(subset=["Mission Level"])  # Supprime les lignes sans niveau
-        .groupby("Mission Level")["Timestamp"]
-        .apply(
-            lambda x: list(timestamps_to_minutes(x))
-        )  # Applique la conversion pour chaque groupe
-        .reset_index(name="Minutes Elapsed")
-    )
-
-    # Retirer les valeurs de minutes égales à 0
-    minutes_per_level["Minutes Elapsed"] = minutes_per_level["Minutes Elapsed"].apply(
-        lambda x: [
-            t for t in x if t > 0.05
-        ]  # Filtrer les valeurs supérieures à 3 seconds
-    )
+        return {}, {}, {}
+
+    # Chaque "Mission Level" devient un entier (-1 pour les lignes sans niveau)
+    # pour réduire avec NumPy sans construire de liste par niveau
+    codes, all_levels = pd.factorize(df["Mission Level"], sort=True)
+    all_levels = np.asarray(all_levels, dtype=object)
+    ticks, nanoseconds_per_tick, has_time = timestamp_ticks(df["Timestamp"])
+    has_time &= codes >= 0
+    codes = codes[has_time]
+    ticks = ticks[has_time]
+    minutes_per_tick = nanoseconds_per_tick / 1e9 / 60
+
+    # Minutes écoulées depuis le premier Timestamp de chaque "Mission Level"
+    base_time = np.full(len(all_levels), np.iinfo(np.int64).max)
+    np.minimum.at(base_time, codes, ticks)
+    minutes = (ticks - base_time[codes]) * minutes_per_tick
+
+    # Retirer les durées inférieures à min_elapsed (3 secondes par défaut)
+    kept = minutes > min_elapsed
+    kept_codes = codes[kept]
+    kept_minutes = minutes[kept]
 
     # Calculer le temps total passé (durée maximale pour chaque Mission Level)
-    minutes_per_level["Max Time Spent"] = minutes_per_level["Minutes Elapsed"].apply(
-        lambda x: max(x) if len(x) > 0 else 0
-    )
-
-    # Fixer un seuil minimal en minutes
-    min_threshold = 0.01
+    time_max = np.zeros(len(all_levels))
+    np.maximum.at(time_max, kept_codes, kept_minutes)
 
     # Récupérer la durée minimale au-dessus du seuil
-    minutes_per_level["Min Time Spent"] = minutes_per_level["Minutes Elapsed"].apply(
-        lambda x: min(
-            [t for t in x if t > min_threshold], default=None
-        )  # Filtrer les valeurs au-dessus du seuil
-    )
+    above = kept_minutes > min_threshold
+    time_min = np.full(len(all_levels), np.inf)
+    np.minimum.at(time_min, kept_codes[above], kept_minutes[above])
+    time_min[np.isinf(time_min)] = np.nan
 
     # Ajouter le temps moyen pour chaque "Mission Level"
-    minutes_per_level["Average Duration"] = minutes_per_level["Minutes Elapsed"].apply(
-        lambda x: sum(x) / len(x) if len(x) > 0 else 0  # Calcule la moyenne des durées
-    )
-
-    # Définir une limite arbitraire (e.g., 24 heures en minutes)
-    threshold = 24 * 60
-
-    # Identifier les anomalies où le temps passé dépasse le seuil
-    anomalies = minutes_per_level[minutes_per_level["Max Time Spent"] > threshold]
-
-    if not anomalies.empty:
-        # print("Anomalies détectées :")
-        # print(anomalies)
+    counts = np.bincount(kept_codes, minlength=len(all_levels))
+    totals = np.bincount(kept_codes, weights=kept_minutes, minlength=len(all_levels))
+    time_avg = np.divide(totals, counts, out=np.zeros(len(all_levels)), where=counts > 0)
 
-        # Filtrer les données pour ne garder que les lignes conformes
-        minutes_per_level = minutes_per_level[
-            minutes_per_level["Max Time Spent"] <= threshold
-        ]
+    # Écarter les anomalies où le temps passé dépasse max_duration (24 heures)
+    normal = time_max <= max_duration
 
-    # print("Contenu final de time_spent :")
-    # print(minutes_per_level)
-
-    time_spent_max = dict(
-        zip(minutes_per_level["Mission Level"], minutes_per_level["Max Time Spent"])
-    )
-    time_spent_min = dict(
-        zip(minutes_per_level["Mission Level"], minutes_per_level["Min Time Spent"])
-    )
-    time_spent_avg = dict(
-        zip(minutes_per_level["Mission Level"], minutes_per_level["Average Duration"])
-    )
+    time_spent_max = dict(zip(all_levels[normal], time_max[normal].tolist()))
+    time_spent_min = dict(zip(all_levels[normal], time_min[normal].tolist()))
+    time_spent_avg = dict(zip(all_levels[normal], time_avg[normal].tolist()))
 
     return time_spent_max, time_spent_min, time_spent_avg
 
 
 def main():
-    data = fetch_lrs_data(NAME)
+    data = iter_lrs_statements(NAME)
     df, all_mission_levels, completed_counts, avg_score_by_level, max_score_by_level = (
         process_data(data)
     )
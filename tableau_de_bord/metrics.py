@@ -0,0 +1,335 @@
+import bisect
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Limites des histogrammes de durée, en secondes
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Avec plusieurs processus (gunicorn), chaque processus enregistre ses
+# compteurs et histogrammes dans SQLite et /metrics renvoie leur somme, quel
+# que soit le processus qui répond (voir share)
+SHARED_PATH = os.environ.get(
+    "SPY_METRICS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "metrics.sqlite"),
+)
+FLUSH_INTERVAL = 5  # Secondes entre deux enregistrements des métriques d'un processus
+# Sans enregistrement depuis ce délai, un processus est considéré comme arrêté
+STALE_AFTER = 6 * FLUSH_INTERVAL
+
+# Métriques exposées sur /metrics : {nom: (type, description)}
+METRICS = {
+    "spy_stage_duration_seconds": (
+        "histogram",
+        "Durée des étapes du traitement (requête LRS, process_data, "
+        "calculate_time_per_level, extract_scores, construction des figures)",
+    ),
+    "spy_callback_duration_seconds": ("histogram", "Durée des callbacks Dash"),
+    "spy_callback_errors_total": ("counter", "Callbacks Dash terminés par une exception"),
+    "spy_dash_update_duration_seconds": (
+        "histogram",
+        "Durée des requêtes /_dash-update-component : callback et sérialisation "
+        "JSON de la réponse (figures et dcc.Store)",
+    ),
+    "spy_dash_response_bytes_total": (
+        "counter",
+        "Octets des réponses JSON envoyées au navigateur par les callbacks",
+    ),
+    "spy_statements_processed_total": ("counter", "Statements traités par process_data"),
+    "spy_lrs_requests_total": ("counter", "Requêtes envoyées au LRS, par code HTTP"),
+    "spy_lrs_bytes_fetched_total": ("counter", "Octets reçus du LRS"),
+    "spy_cache_requests_total": ("counter", "Accès aux caches, réussis (hit) ou non (miss)"),
+}
+
+_lock = threading.Lock()
+_counters = {}  # {(nom, étiquettes): valeur}
+_histograms = {}  # {(nom, étiquettes): [comptes par limite..., somme, nombre]}
+_gauges = {}  # {nom: (description, fonction renvoyant {étiquettes: valeur})}
+_shared_path = None  # Base partagée, None si les métriques restent locales
+_process = None  # (pid, identifiant unique du processus dans la base partagée)
+_flusher_pid = None  # Processus dont le thread d'enregistrement est démarré
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    key = (name, label_key(labels))
+    ensure_flusher()
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    key = (name, label_key(labels))
+    ensure_flusher()
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = [0] * len(BUCKETS) + [0.0, 0]
+            _histograms[key] = histogram
+        position = bisect.bisect_left(BUCKETS, value)
+        if position < len(BUCKETS):
+            histogram[position] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def cache_access(cache, hit):
+    increment("spy_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def gauge(name, description, function):
+    # function() renvoie la valeur, ou {étiquettes (dict en tuple): valeur}
+    with _lock:
+        _gauges[name] = (description, function)
+
+
+@contextmanager
+def measure(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("spy_stage_duration_seconds", time.perf_counter() - start, stage=stage)
+
+
+def timed(stage):
+    # Décorateur : mesure chaque appel de la fonction comme une étape
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with measure(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_callback(function):
+    # Décorateur des callbacks Dash, à placer sous @app.callback
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            increment("spy_callback_errors_total", callback=function.__name__)
+            raise
+        finally:
+            observe(
+                "spy_callback_duration_seconds",
+                time.perf_counter() - start,
+                callback=function.__name__,
+            )
+
+    return wrapper
+
+
+def share(path=SHARED_PATH):
+    # Active le partage des compteurs et histogrammes entre les processus du
+    # serveur. Après un fork, le processus enfant repart de zéro : les valeurs
+    # du parent (préchauffage) sont enregistrées une seule fois, par le parent.
+    global _shared_path
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with shared_connection(path) as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+        create_table(connection)
+    if _shared_path is None:
+        os.register_at_fork(before=flush, after_in_child=reset)
+    _shared_path = path
+
+
+def create_table(connection):
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS metrics "
+        "(process TEXT PRIMARY KEY, payload TEXT NOT NULL, updated_at REAL NOT NULL)"
+    )
+
+
+def clear(path=SHARED_PATH):
+    # Au démarrage du serveur, dans le processus maître avant la création des
+    # workers (gunicorn.conf.py) : les compteurs repartent de zéro, sans les
+    # processus des lancements précédents. Ceux du maître (préchauffage)
+    # sont gardés.
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with shared_connection(path) as connection:
+        create_table(connection)
+        connection.execute("DELETE FROM metrics WHERE process != ?", (process_id(),))
+
+
+@contextmanager
+def shared_connection(path):
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def reset():
+    global _counters, _histograms
+    with _lock:
+        _counters = {}
+        _histograms = {}
+
+
+def process_id():
+    # Le pid seul ne suffit pas : un processus recyclé peut reprendre le pid
+    # d'un ancien, dont les compteurs ne doivent pas être écrasés
+    global _process
+    pid = os.getpid()
+    if _process is None or _process[0] != pid:
+        _process = (pid, f"{pid}-{uuid.uuid4().hex}")
+    return _process[1]
+
+
+def process_alive(process):
+    pid = int(process.split("-", 1)[0])
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prune(connection):
+    # Supprime les lignes des processus arrêtés (worker recyclé ou tombé) :
+    # sans enregistrement récent ou dont le pid n'existe plus
+    rows = connection.execute("SELECT process, updated_at FROM metrics").fetchall()
+    stale_before = time.time() - STALE_AFTER
+    dead = [
+        (process,)
+        for process, updated_at in rows
+        if updated_at < stale_before or not process_alive(process)
+    ]
+    connection.executemany("DELETE FROM metrics WHERE process = ?", dead)
+
+
+def ensure_flusher():
+    # Thread d'enregistrement périodique, un par processus
+    global _flusher_pid
+    if _shared_path is None or _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=flush_periodically, daemon=True).start()
+
+
+def flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def flush():
+    # Enregistre les valeurs de ce processus dans la base partagée
+    if _shared_path is None:
+        return
+    with _lock:
+        payload = {
+            "counters": [[name, labels, value] for (name, labels), value in _counters.items()],
+            "histograms": [
+                [name, labels, histogram] for (name, labels), histogram in _histograms.items()
+            ],
+        }
+    try:
+        with shared_connection(_shared_path) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?)",
+                (process_id(), json.dumps(payload), time.time()),
+            )
+    except sqlite3.Error as e:
+        print(f"Enregistrement des métriques impossible : {e}")
+
+
+def collect():
+    # Compteurs et histogrammes de tous les processus, additionnés
+    if _shared_path is None:
+        with _lock:
+            return dict(_counters), {key: list(value) for key, value in _histograms.items()}
+    flush()
+    counters = {}
+    histograms = {}
+    with shared_connection(_shared_path) as connection:
+        prune(connection)
+        rows = connection.execute("SELECT payload FROM metrics").fetchall()
+    for (payload,) in rows:
+        payload = json.loads(payload)
+        for name, labels, value in payload["counters"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in payload["histograms"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            histogram = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                histogram[i] += value
+    return counters, histograms
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    # Format texte de Prometheus (version 0.0.4)
+    counters, histograms = collect()
+    with _lock:
+        gauges = dict(_gauges)
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+            continue
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            # Les comptes des limites sont cumulés, +Inf compte toutes les mesures
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram[:-2]):
+                cumulative += count
+                bucket_labels = labels + (("le", format_value(float(bound))),)
+                lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+            bucket_labels = labels + (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{format_labels(bucket_labels)} {histogram[-1]}")
+            lines.append(f"{name}_sum{format_labels(labels)} {format_value(histogram[-2])}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram[-1]}")
+
+    for name, (description, function) in sorted(gauges.items()):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        values = function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+    return "\n".join(lines) + "\n"
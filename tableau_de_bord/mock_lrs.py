@@ -0,0 +1,326 @@
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from statement_store import normalize_timestamp
+from synthetic import iter_player
+
+STATEMENTS_PATH = "/data/xAPI/statements"
+MAX_LIMIT = 500  # Taille de page maximale, comme un LRS réel
+# Filtres xAPI non gérés : refusés plutôt qu'ignorés, pour ne jamais renvoyer
+# plus de statements que n'en renverrait un LRS réel
+UNSUPPORTED_PARAMS = {
+    "statementId",
+    "voidedStatementId",
+    "registration",
+    "related_agents",
+    "ascending",
+}
+CONTEXT_ACTIVITY_TYPES = ("parent", "grouping", "category", "other")
+
+
+def load_fixtures(path):
+    # Liste JSON, objet {"statements": [...]} ou un statement JSON par ligne
+    with open(path, encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in file if line.strip()]
+        data = json.load(file)
+    return data["statements"] if isinstance(data, dict) else data
+
+
+def agent_name(statement):
+    actor = statement.get("actor", {})
+    return actor.get("account", {}).get("name") or actor.get("name")
+
+
+def activity_ids(statement, related=False):
+    # Activité du statement, plus avec related celles de son contexte et de
+    # son sous-statement, comme le paramètre related_activities d'un LRS
+    target = statement.get("object", {})
+    ids = set()
+    if target.get("objectType", "Activity") == "Activity" and "id" in target:
+        ids.add(target["id"])
+    if not related:
+        return ids
+    context_activities = statement.get("context", {}).get("contextActivities", {})
+    for activity_type in CONTEXT_ACTIVITY_TYPES:
+        activities = context_activities.get(activity_type, [])
+        if isinstance(activities, dict):
+            activities = [activities]
+        ids.update(activity["id"] for activity in activities if "id" in activity)
+    if target.get("objectType") == "SubStatement":
+        ids |= activity_ids(target, related=True)
+    return ids
+
+
+def statement_filter(verb=None, activity=None, related=False):
+    # Prédicat des filtres verb et activity, None sans filtre
+    if verb is None and activity is None:
+        return None
+
+    def match(statement):
+        if verb is not None and statement.get("verb", {}).get("id") != verb:
+            return False
+        return activity is None or activity in activity_ids(statement, related)
+
+    return match
+
+
+class AgentStatements:
+    # Statements d'un joueur triés par date d'enregistrement croissante, pour
+    # trouver les bornes since/until par dichotomie
+    def __init__(self, statements):
+        # L'indice départage les statements enregistrés au même instant
+        keyed = sorted(
+            (normalize_timestamp(statement.get("stored") or statement["timestamp"]), i, statement)
+            for i, statement in enumerate(statements)
+        )
+        self.keys = [key for key, _, _ in keyed]
+        self.statements = [statement for _, _, statement in keyed]
+
+    def filter(self, match):
+        # Sous-ensemble déjà trié : offset et since/until portent ensuite sur
+        # les seuls statements retenus, comme la pagination d'un LRS filtré
+        filtered = AgentStatements([])
+        for key, statement in zip(self.keys, self.statements):
+            if match(statement):
+                filtered.keys.append(key)
+                filtered.statements.append(statement)
+        return filtered
+
+    def page(self, since=None, until=None, offset=0, limit=MAX_LIMIT):
+        # Du plus récent au plus ancien, comme le LRS
+        low = bisect.bisect_right(self.keys, since) if since else 0
+        high = bisect.bisect_right(self.keys, until) if until else len(self.keys)
+        end = max(high - offset, low)
+        start = max(end - limit, low)
+        return self.statements[start:end][::-1], start > low
+
+
+class MockLRS:
+    # LRS local pour les tests de charge et de latence. Les statements
+    # viennent de fixtures ou sont générés par synthetic.py (generate
+    # statements par joueur demandé). Latence, erreurs et limitation du débit
+    # sont configurables.
+    def __init__(
+        self,
+        statements=None,
+        generate=None,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        rate_limit=None,
+        max_limit=MAX_LIMIT,
+        seed=0,
+    ):
+        self.generate = generate
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.max_limit = max_limit
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.agents = {}
+        self.filtered = {}  # (joueur, verb, activity, related) -> AgentStatements
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.tokens = rate_limit
+        self.refilled_at = time.monotonic()
+        self.server = None
+
+        grouped = {}
+        for statement in statements or []:
+            grouped.setdefault(agent_name(statement), []).append(statement)
+        for name, agent_statements in grouped.items():
+            self.agents[name] = AgentStatements(agent_statements)
+
+    def agent_statements(self, name):
+        with self.lock:
+            statements = self.agents.get(name)
+            if statements is None and self.generate:
+                statements = AgentStatements(
+                    iter_player(self.generate, player=name, seed=self.seed)
+                )
+                self.agents[name] = statements
+        return statements
+
+    def filtered_statements(self, name, verb=None, activity=None, related=False):
+        match = statement_filter(verb, activity, related)
+        if match is None:
+            return self.agent_statements(name)
+        key = (name, verb, activity, related)
+        with self.lock:
+            filtered = self.filtered.get(key)
+        if filtered is None:
+            statements = self.agent_statements(name)
+            if statements is None:
+                return None
+            # Calculé une fois par combinaison de filtres : les pages
+            # suivantes (lien "more") réutilisent le même sous-ensemble
+            filtered = statements.filter(match)
+            with self.lock:
+                self.filtered[key] = filtered
+        return filtered
+
+    def throttle(self):
+        # Seau à jetons : rate_limit requêtes par seconde au plus
+        if self.rate_limit is None:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate_limit, self.tokens + (now - self.refilled_at) * self.rate_limit
+            )
+            self.refilled_at = now
+            if self.tokens < 1:
+                self.throttled += 1
+                return True
+            self.tokens -= 1
+            return False
+
+    def handle(self, query):
+        # Renvoie (statut, en-têtes, corps) pour une requête GET
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+        if self.throttle():
+            return 429, {"Retry-After": "1"}, {"error": "Too Many Requests"}
+        if failed:
+            with self.lock:
+                self.errors += 1
+            return 503, {}, {"error": "Service Unavailable"}
+
+        unsupported = sorted(UNSUPPORTED_PARAMS & set(query))
+        if unsupported:
+            return 400, {}, {"error": f"Paramètre non géré : {', '.join(unsupported)}"}
+        try:
+            agent = json.loads(query["agent"])
+            name = agent.get("account", {}).get("name") or agent.get("name")
+            since = normalize_timestamp(query["since"]) if "since" in query else None
+            until = normalize_timestamp(query["until"]) if "until" in query else None
+            limit = int(query.get("limit", 0)) or self.max_limit
+            offset = int(query.get("offset", 0))
+            related = query.get("related_activities", "false")
+            if related not in ("true", "false"):
+                raise ValueError(f"related_activities={related}")
+        except (KeyError, ValueError) as e:
+            return 400, {}, {"error": f"Requête invalide : {e}"}
+        limit = min(limit, self.max_limit)
+
+        statements = self.filtered_statements(
+            name, query.get("verb"), query.get("activity"), related == "true"
+        )
+        if statements is None:
+            return 200, {}, {"statements": [], "more": ""}
+        page, has_more = statements.page(since, until, offset, limit)
+        more = ""
+        if has_more:
+            # Comme un LRS réel, le lien "more" reprend tous les paramètres
+            more = STATEMENTS_PATH + "?" + urlencode(
+                dict(query, offset=offset + len(page))
+            )
+        return 200, {}, {"statements": page, "more": more}
+
+    def start(self, host="127.0.0.1", port=0):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 : les connexions du pool du client restent ouvertes
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != STATEMENTS_PATH:
+                    status, headers, body = 404, {}, {"error": "Not Found"}
+                else:
+                    query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                    status, headers, body = mock.handle(query)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("X-Experience-API-Version", "1.0.3")
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.endpoint
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{STATEMENTS_PATH}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LRS local pour tester le tableau de bord")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8181)
+    parser.add_argument("--fixtures", help="Fichier JSON ou JSONL de statements")
+    parser.add_argument(
+        "--generate",
+        type=int,
+        default=None,
+        help="Statements générés pour chaque joueur demandé (sans fixtures : 10000)",
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="Secondes par requête")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latence aléatoire ajoutée")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Part de réponses 503")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Requêtes par seconde")
+    parser.add_argument("--max-limit", type=int, default=MAX_LIMIT)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    statements = load_fixtures(args.fixtures) if args.fixtures else None
+    generate = args.generate
+    if generate is None and statements is None:
+        generate = 10000
+    mock = MockLRS(
+        statements,
+        generate=generate,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        max_limit=args.max_limit,
+        seed=args.seed,
+    )
+    endpoint = mock.start(args.host, args.port)
+    print(f"LRS local : {endpoint}")
+    print(f"Pour l'utiliser : SPY_LRS_ENDPOINT={endpoint} python tableau_final.py")
+    try:
+        while True:
+            time.sleep(60)
+            print(
+                f"{mock.requests} requête(s), {mock.errors} erreur(s), "
+                f"{mock.throttled} limitée(s)"
+            )
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
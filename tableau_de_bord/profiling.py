@@ -0,0 +1,89 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import time
+import uuid
+from urllib.parse import parse_qs, urlparse
+
+import flask
+
+# Profilage à la demande : pour toutes les requêtes avec SPY_PROFILE=1, ou
+# pour une page ouverte avec ?profile=1 (les callbacks de la page sont alors
+# profilés, l'adresse de la page étant envoyée dans l'en-tête Referer)
+PROFILE_ALL = os.environ.get("SPY_PROFILE", "") not in ("", "0")
+PROFILE_DIR = os.environ.get(
+    "SPY_PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"),
+)
+QUERY_FLAG = "profile"
+TOP_N = 15  # Fonctions affichées dans le résumé du journal
+
+
+def profiling_requested():
+    if PROFILE_ALL:
+        return True
+    if not flask.has_request_context():
+        return False
+    referrer = flask.request.referrer
+    # Test rapide avant d'analyser l'adresse : coût négligeable sans le drapeau
+    if not referrer or QUERY_FLAG not in referrer:
+        return False
+    values = parse_qs(urlparse(referrer).query).get(QUERY_FLAG, [])
+    return any(value not in ("", "0") for value in values)
+
+
+def run_profiled(function, *args, **kwargs):
+    # Exécute la fonction sous cProfile, enregistre le profil dans PROFILE_DIR
+    # (lisible avec pstats ou snakeviz) et affiche les fonctions les plus
+    # coûteuses dans le journal
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Un seul profileur actif à la fois (Python 3.12+) : un autre callback
+        # est déjà profilé dans un autre thread
+        print(f"Profilage de {function.__name__} ignoré : un profil est déjà en cours")
+        return function(*args, **kwargs)
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profile.disable()
+        elapsed = time.perf_counter() - start
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(
+            PROFILE_DIR,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{function.__name__}-{uuid.uuid4().hex[:8]}.prof",
+        )
+        profile.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(TOP_N)
+        print(f"Profil de {function.__name__} ({elapsed:.3f} s) enregistré dans {path}")
+        print(summary.getvalue())
+
+
+def profiled(function):
+    # Décorateur des callbacks Dash : sans profilage demandé, la fonction est
+    # appelée directement
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not profiling_requested():
+            return function(*args, **kwargs)
+        return run_profiled(function, *args, **kwargs)
+
+    return wrapper
+
+
+def when_requested(function):
+    # Pour les jobs en arrière-plan : la demande de profilage est lue au moment
+    # de la soumission, pendant la requête, et le job est profilé dans son thread
+    if not profiling_requested():
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return run_profiled(function, *args, **kwargs)
+
+    return wrapper
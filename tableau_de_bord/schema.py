@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+# Schéma de la table des statements renvoyée par process_data et lue par
+# calculate_time_per_level, build_level_cube et le tableau de bord :
+#
+#   Timestamp      int64     nanosecondes depuis le 1er janvier 1970 (UTC),
+#                            MISSING_TIMESTAMP si le statement n'a pas de date
+#   Verb           category  dernier segment de l'id du verbe ("completed", ...)
+#   Actor          category  nom de l'acteur
+#   Object         category  id de l'objet
+#   Score          float32   score si le niveau est réussi, NaN sinon
+#   Mission Level  category  niveau, reporté depuis le dernier statement qui
+#                            l'indique
+#   Scenario       category  scénario indiqué par le statement, sinon absent
+#
+# Les chaînes sont encodées une fois par valeur distincte (quelques verbes,
+# niveaux et scénarios pour des millions de lignes) et les groupby travaillent
+# sur les codes entiers. Les colonnes "category" doivent être groupées avec
+# observed=True pour ne pas produire les combinaisons absentes.
+STATEMENT_SCHEMA = {
+    "Timestamp": "int64",
+    "Verb": "category",
+    "Actor": "category",
+    "Object": "category",
+    "Score": "float32",
+    "Mission Level": "category",
+    "Scenario": "category",
+}
+MISSING_TIMESTAMP = np.iinfo(np.int64).min  # Même valeur que NaT dans pandas
+
+
+def to_epoch_ns(values):
+    # Dates ISO 8601 (ou datetime) vers des entiers en nanosecondes UTC
+    timestamps = pd.to_datetime(pd.Series(values, dtype=object), utc=True, format="ISO8601")
+    return timestamps.astype("datetime64[ns, UTC]").array.asi8
+
+
+def to_compact(frame):
+    # Convertit une table de statements au schéma compact
+    compact = pd.DataFrame(index=frame.index)
+    for column, dtype in STATEMENT_SCHEMA.items():
+        values = frame[column]
+        if column == "Timestamp":
+            if pd.api.types.is_integer_dtype(values.dtype):
+                compact[column] = values.astype("int64")
+            else:
+                compact[column] = to_epoch_ns(values)
+        else:
+            compact[column] = values.astype(dtype)
+    return compact
+
+
+def from_compact(compact):
+    # Table avec des dates et des chaînes Python, pour l'affichage ou l'export
+    frame = compact.astype(
+        {column: object for column, dtype in STATEMENT_SCHEMA.items() if dtype == "category"}
+    )
+    frame["Timestamp"] = pd.to_datetime(compact["Timestamp"].to_numpy(), utc=True)
+    frame["Score"] = compact["Score"].astype(float)
+    return frame
+
+
+def timestamp_ticks(timestamps):
+    # Renvoie les dates en entiers, la durée d'un entier en nanosecondes et le
+    # masque des dates connues, que la colonne suive le schéma (int64) ou non
+    if pd.api.types.is_integer_dtype(timestamps.dtype):
+        ticks = timestamps.to_numpy(dtype="int64")
+        return ticks, 1, ticks != MISSING_TIMESTAMP
+    array = timestamps.array
+    return array.asi8, pd.Timedelta(1, unit=array.unit).value, ~array.isna()
+
+
+def in_window(ticks, nanoseconds_per_tick=1, since=None, until=None):
+    # Masque des dates comprises dans la période [since, until] (dates ISO
+    # 8601 incluses, None pour une période ouverte)
+    mask = np.ones(len(ticks), dtype=bool)
+    if since is not None:
+        mask &= ticks >= to_epoch_ns([since])[0] // nanoseconds_per_tick
+    if until is not None:
+        mask &= ticks <= to_epoch_ns([until])[0] // nanoseconds_per_tick
+    return mask
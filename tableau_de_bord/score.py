@@ -1,54 +1,120 @@
 import os
+import threading
 import xml.etree.ElementTree as ET
 
+import metrics
+
+LEVELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Levels", "Levels")
+
+# Dossiers de niveaux ignorés, modifiables avec la variable d'environnement
+# SPY_SKIPPED_FOLDERS (noms séparés par des virgules)
+SKIPPED_FOLDERS = tuple(
+    folder.strip()
+    for folder in os.environ.get(
+        "SPY_SKIPPED_FOLDERS", "RonDoor_Scenario,Selectionneur,Tutoriel,ELS"
+    ).split(",")
+    if folder.strip()
+)
+
+READ_SIZE = 16384
+
+# Seuils déjà lus, par fichier : {chemin: (mtime, seuils)}
+_file_scores = {}
+# Dernier catalogue construit : {(dossier, ignorés): (signature, catalogue)}
+_catalogs = {}
+_catalog_lock = threading.Lock()
 
-def extract_scores(base_dir):
-    result = {}
 
+def read_score(file_path):
+    # Lit le fichier par blocs et s'arrête dès le premier élément <score>, sans
+    # construire l'arbre complet (la carte du niveau peut être volumineuse)
+    parser = ET.XMLPullParser(events=("start",))
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(READ_SIZE), b""):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if element.tag == "score":
+                    two_stars = element.get("twoStars")
+                    three_stars = element.get("threeStars")
+                    if two_stars and three_stars is not None:
+                        return int(two_stars), int(three_stars)
+                    return None
+    parser.close()
+    return None
+
+
+def level_files(base_dir, skipped_folders=SKIPPED_FOLDERS):
     # Parcourir tous les dossiers dans le répertoire principal
     for folder in os.listdir(base_dir):
-        # print("blabla", os.listdir(base_dir))
         folder_path = os.path.join(base_dir, folder)
-        # print("blabla", os.listdir(folder_path))
 
         # Vérifier si c'est un dossier et ignorer les dossiers spécifiques
-        if os.path.isdir(folder_path) and folder not in [
-            "RonDoor_Scenario",
-            "Selectionneur",
-            "Tutoriel",
-            "ELS",
-        ]:
-            folder_scores = {}
+        if os.path.isdir(folder_path) and folder not in skipped_folders:
+            files = [
+                os.path.join(folder_path, file)
+                for file in os.listdir(folder_path)
+                if file.endswith(".xml")
+            ]
+            yield folder, files
 
-            # Parcourir les fichiers dans le dossier
-            for file in os.listdir(folder_path):
-                # print(file)
-                if file.endswith(".xml"):
-                    file_path = os.path.join(folder_path, file)
 
-                    # Extraire le score max du fichier XML
+@metrics.timed("extract_scores")
+def extract_scores(base_dir, skipped_folders=SKIPPED_FOLDERS):
+    result = {}
+    for folder, files in level_files(base_dir, skipped_folders):
+        folder_scores = {}
+        for file_path in files:
+            # Extraire le score max du fichier XML
+            try:
+                scores = read_score(file_path)
+            except ET.ParseError:
+                print(f"Erreur de parsing dans le fichier : {file_path}")
+                continue
+            if scores is not None:
+                # Enregistrer le score max dans le dictionnaire
+                level_name = os.path.splitext(os.path.basename(file_path))[0]
+                folder_scores[level_name] = scores
+
+        # Ajouter les scores du dossier au résultat principal
+        result[folder] = folder_scores
+    return result
+
+
+@metrics.timed("level_catalog")
+def get_level_catalog(base_dir=LEVELS_DIR, skipped_folders=SKIPPED_FOLDERS):
+    # Même résultat que extract_scores, gardé en cache pour tout le processus.
+    # Seuls les fichiers XML ajoutés ou modifiés (mtime) sont relus. Le
+    # dictionnaire renvoyé est partagé et ne doit pas être modifié.
+    with _catalog_lock:
+        listing = [
+            (folder, [(path, os.stat(path).st_mtime_ns) for path in files])
+            for folder, files in level_files(base_dir, skipped_folders)
+        ]
+        key = (base_dir, tuple(skipped_folders))
+        cached = _catalogs.get(key)
+        if cached is not None and cached[0] == listing:
+            metrics.cache_access("level_catalog", hit=True)
+            return cached[1]
+        metrics.cache_access("level_catalog", hit=False)
+
+        result = {}
+        for folder, files in listing:
+            folder_scores = {}
+            for file_path, mtime in files:
+                scores = _file_scores.get(file_path)
+                if scores is None or scores[0] != mtime:
                     try:
-                        tree = ET.parse(file_path)
-                        root = tree.getroot()
-
-                        # Rechercher l'élément <score>
-                        score_element = root.find(".//score")
-                        if score_element is not None:
-                            two_stars = score_element.get("twoStars")
-                            three_stars = score_element.get("threeStars")
-                            if two_stars and three_stars is not None:
-                                # Enregistrer le score max dans le dictionnaire
-                                level_name = os.path.splitext(file)[0]
-                                folder_scores[level_name] = int(two_stars), int(
-                                    three_stars
-                                )
+                        scores = (mtime, read_score(file_path))
                     except ET.ParseError:
                         print(f"Erreur de parsing dans le fichier : {file_path}")
-
-            # Ajouter les scores du dossier au résultat principal
+                        scores = (mtime, None)
+                    _file_scores[file_path] = scores
+                if scores[1] is not None:
+                    level_name = os.path.splitext(os.path.basename(file_path))[0]
+                    folder_scores[level_name] = scores[1]
             result[folder] = folder_scores
-            # print(result)
-    return result
+        _catalogs[key] = (listing, result)
+        return result
 
 
 def main():
@@ -0,0 +1,289 @@
+import argparse
+import os
+import shutil
+from urllib.parse import quote, unquote
+
+import pandas as pd
+
+from level_stats import build_level_cube
+from lrs_request import process_data
+from schema import STATEMENT_SCHEMA
+from statement_store import get_store
+
+# pyarrow est facultatif : il n'est nécessaire que pour les instantanés
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Dossier des instantanés, modifiable avec la variable d'environnement
+# SPY_SNAPSHOT_DIR
+SNAPSHOT_DIR = os.environ.get(
+    "SPY_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"),
+)
+# Arrow (IPC) non compressé : relu par memory map sans copie. Parquet : plus
+# compact, mais décodé à la lecture.
+FORMATS = {"arrow": ".arrow", "parquet": ".parquet"}
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"  # Statements sans scénario
+LEVEL_COLUMNS = [
+    "Scenario",
+    "Mission Level",
+    "statements",
+    "completions",
+    "score_count",
+    "avg_score",
+    "max_score",
+    "min_score",
+    "time_max",
+    "time_min",
+    "time_avg",
+]
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError(
+            "Les instantanés nécessitent pyarrow : pip install pyarrow"
+        )
+
+
+def partition_name(key, value):
+    # Partitions au format Hive (player=.../scenario=...), lisibles aussi avec
+    # pyarrow.dataset.dataset(dossier, partitioning="hive")
+    if value is None or pd.isna(value):
+        return f"{key}={NULL_PARTITION}"
+    return f"{key}={quote(str(value), safe='')}"
+
+
+def partition_value(name):
+    value = unquote(name.split("=", 1)[1])
+    return None if value == NULL_PARTITION else value
+
+
+def write_table(table, path, format):
+    if format == "arrow":
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        pq.write_table(table, path)
+
+
+def read_table(path):
+    # Le fichier est projeté en mémoire : les colonnes Arrow pointent
+    # directement dans le fichier, sans lecture ni copie préalable
+    if path.endswith(FORMATS["arrow"]):
+        return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return pq.read_table(path, memory_map=True)
+
+
+def level_rows(cube):
+    return pd.DataFrame(
+        [
+            {"Scenario": scenario, "Mission Level": level, **stats}
+            for scenario, levels in cube.items()
+            for level, stats in levels.items()
+        ],
+        columns=LEVEL_COLUMNS,
+    )
+
+
+def export_snapshot(agent_name, df, cube=None, directory=SNAPSHOT_DIR, format="arrow"):
+    # Écrit la table des statements (schéma compact) et les agrégats par
+    # niveau du joueur, un fichier par scénario :
+    #   <dossier>/player=<joueur>/scenario=<scénario>/statements.arrow
+    #   <dossier>/player=<joueur>/scenario=<scénario>/levels.arrow
+    require_pyarrow()
+    if cube is None:
+        cube = build_level_cube(df)
+    levels = level_rows(cube)
+    player_dir = os.path.join(directory, partition_name("player", agent_name))
+    # Un nouvel instantané du joueur remplace entièrement le précédent
+    shutil.rmtree(player_dir, ignore_errors=True)
+
+    extension = FORMATS[format]
+    scenarios = df["Scenario"].astype(object)
+    for scenario, group in df.groupby(scenarios.fillna(NULL_PARTITION), sort=False):
+        scenario = None if scenario == NULL_PARTITION else scenario
+        scenario_dir = os.path.join(player_dir, partition_name("scenario", scenario))
+        os.makedirs(scenario_dir, exist_ok=True)
+        write_table(
+            pa.Table.from_pandas(group, preserve_index=False),
+            os.path.join(scenario_dir, "statements" + extension),
+            format,
+        )
+        if scenario is not None:
+            write_table(
+                pa.Table.from_pandas(
+                    levels[levels["Scenario"] == scenario], preserve_index=False
+                ),
+                os.path.join(scenario_dir, "levels" + extension),
+                format,
+            )
+    return player_dir
+
+
+def export_player(agent_name, store=None, directory=SNAPSHOT_DIR, format="arrow"):
+    # Instantané du joueur à partir du cache local des statements
+    store = store or get_store()
+    df = process_data(store.iter_statements(agent_name))[0]
+    return export_snapshot(agent_name, df, directory=directory, format=format)
+
+
+def snapshot_files(directory, name, players=None, scenarios=None):
+    # Fichiers <name> des partitions demandées : [(joueur, scénario, chemin)]
+    files = []
+    if not os.path.isdir(directory):
+        return files
+    for player_name in sorted(os.listdir(directory)):
+        if not player_name.startswith("player="):
+            continue
+        player = partition_value(player_name)
+        if players is not None and player not in players:
+            continue
+        player_dir = os.path.join(directory, player_name)
+        for scenario_name in sorted(os.listdir(player_dir)):
+            scenario = partition_value(scenario_name)
+            if scenarios is not None and scenario not in scenarios:
+                continue
+            for extension in FORMATS.values():
+                path = os.path.join(player_dir, scenario_name, name + extension)
+                if os.path.exists(path):
+                    files.append((player, scenario, path))
+    return files
+
+
+def has_snapshot(agent_name, directory=SNAPSHOT_DIR):
+    return os.path.isdir(os.path.join(directory, partition_name("player", agent_name)))
+
+
+def open_statements(directory=SNAPSHOT_DIR, players=None, scenarios=None):
+    # Table Arrow des statements, projetée en mémoire, avec une colonne
+    # "Player" ajoutée depuis les partitions. Pour les notebooks : on peut
+    # filtrer ou agréger la table avant de la convertir en DataFrame.
+    require_pyarrow()
+    tables = []
+    for player, scenario, path in snapshot_files(
+        directory, "statements", players, scenarios
+    ):
+        table = read_table(path)
+        tables.append(
+            table.append_column(
+                "Player", pa.array([player] * table.num_rows, pa.string()).dictionary_encode()
+            )
+        )
+    if not tables:
+        return None
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+def load_statements(directory=SNAPSHOT_DIR, players=None, scenarios=None):
+    # DataFrame au schéma compact (plus la colonne "Player"), dans l'ordre du
+    # LRS : du plus récent au plus ancien pour chaque joueur
+    table = open_statements(directory, players, scenarios)
+    if table is None:
+        return pd.DataFrame(
+            {column: pd.Series(dtype=dtype) for column, dtype in STATEMENT_SCHEMA.items()}
+        ).assign(Player=pd.Series(dtype="category"))
+    # Conversion en une étape : les colonnes dictionnaire deviennent
+    # directement des category et chaque tampon Arrow est libéré dès sa
+    # colonne convertie (self_destruct). Contrairement à la table
+    # d'open_statements, le DataFrame est une copie : les fichiers sont
+    # concaténés puis triés.
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
+    # Colonnes d'un autre type (partition sans aucune valeur...) seulement
+    mismatched = {
+        column: dtype
+        for column, dtype in STATEMENT_SCHEMA.items()
+        if column in df and df[column].dtype != dtype
+    }
+    if mismatched:
+        df = df.astype(mismatched)
+    return df.sort_values(
+        ["Player", "Timestamp"], ascending=[True, False], kind="stable"
+    ).reset_index(drop=True)
+
+
+def load_levels(directory=SNAPSHOT_DIR, players=None, scenarios=None):
+    # Agrégats par joueur, scénario et niveau enregistrés avec les statements
+    require_pyarrow()
+    frames = []
+    for player, scenario, path in snapshot_files(directory, "levels", players, scenarios):
+        # "attempts" : nom de la colonne dans les instantanés plus anciens
+        frames.append(
+            read_table(path)
+            .to_pandas()
+            .rename(columns={"attempts": "statements"})
+            .assign(Player=player)
+        )
+    if not frames:
+        return pd.DataFrame(columns=["Player"] + LEVEL_COLUMNS)
+    return pd.concat(frames, ignore_index=True)[["Player"] + LEVEL_COLUMNS]
+
+
+def level_aggregates(df):
+    # Agrégats par niveau de process_data, recalculés sur la table enregistrée
+    levels = df.dropna(subset=["Mission Level"])
+    scores = levels.assign(Score=levels["Score"].astype(float)).groupby(
+        "Mission Level", observed=True, sort=False
+    )["Score"]
+    completed = levels[levels["Verb"] == "completed"]
+    completed_counts = {
+        level: int(count)
+        for level, count in completed.groupby(
+            "Mission Level", observed=True, sort=False
+        ).size().items()
+    }
+    stats = scores.agg(["sum", "count", "max"])
+    avg_score_by_level = {
+        level: round(float(row["sum"]) / row["count"]) if row["count"] > 0 else None
+        for level, row in stats.iterrows()
+    }
+    max_score_by_level = {
+        level: float(row["max"]) if row["count"] > 0 else None
+        for level, row in stats.iterrows()
+    }
+    return list(stats.index), completed_counts, avg_score_by_level, max_score_by_level
+
+
+def load_cube(agent_name, directory=SNAPSHOT_DIR):
+    # Même structure que build_level_cube, sans recalcul
+    cube = {}
+    for row in load_levels(directory, players=[agent_name]).to_dict("records"):
+        stats = {
+            key: (None if pd.isna(value) else value)
+            for key, value in row.items()
+            if key not in ("Player", "Scenario", "Mission Level")
+        }
+        for key in ("statements", "completions", "score_count"):
+            stats[key] = int(stats[key])
+        cube.setdefault(row["Scenario"], {})[row["Mission Level"]] = stats
+    return cube
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export des données traitées des joueurs en instantanés Arrow/Parquet"
+    )
+    parser.add_argument("players", nargs="+", help="Noms des joueurs à exporter")
+    parser.add_argument("--directory", default=SNAPSHOT_DIR)
+    parser.add_argument("--format", choices=sorted(FORMATS), default="arrow")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Synchroniser les joueurs avec le LRS avant l'export",
+    )
+    args = parser.parse_args()
+
+    store = get_store()
+    for agent_name in args.players:
+        if args.sync:
+            store.sync(agent_name)
+        print(export_player(agent_name, store, args.directory, args.format))
+
+
+if __name__ == "__main__":
+    main()
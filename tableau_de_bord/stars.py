@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+# Règles de correspondance entre le catalogue des niveaux et les statements :
+# remplacements appliqués aux noms des fichiers de niveaux ("Niveau01.xml")
+# pour retrouver le niveau des statements ("mission01")
+LEVEL_NAME_RULES = [("Niveau", "mission")]
+# Niveaux sans étoiles pour le joueur, par scénario (ils restent comptés dans
+# le total possible du scénario)
+EXCLUDED_LEVELS = {"Infiltration": [f"mission{i:02d}" for i in range(1, 9)]}
+STARS_PER_LEVEL = 3
+
+PLAYER_STARS = "Nombre d'étoiles du joueur par scénario"
+TOTAL_STARS = "Nombre d'étoiles total par scénario"
+
+# Table des seuils du dernier catalogue utilisé, recalculée s'il change
+_thresholds = (None, None)
+
+
+def threshold_table(star_scores):
+    # Une ligne par niveau du catalogue où le joueur peut gagner des étoiles :
+    # scénario, niveau des statements, seuils des 2 et 3 étoiles, et numéro du
+    # scénario pour les sommes par scénario
+    global _thresholds
+    catalog, table = _thresholds
+    if catalog is star_scores:
+        return table
+    rows = [
+        (scenario, level, two_stars, three_stars)
+        for scenario, levels in star_scores.items()
+        for level, (two_stars, three_stars) in levels.items()
+    ]
+    table = pd.DataFrame(rows, columns=["Scénario", "Level", "two_stars", "three_stars"])
+    for pattern, replacement in LEVEL_NAME_RULES:
+        table["Level"] = table["Level"].str.replace(pattern, replacement, regex=False)
+    excluded = pd.Series(False, index=table.index)
+    for scenario, levels in EXCLUDED_LEVELS.items():
+        excluded |= (table["Scénario"] == scenario) & table["Level"].isin(levels)
+    table = table[~excluded].reset_index(drop=True)
+    table["scenario_code"] = pd.Categorical(table["Scénario"], categories=list(star_scores)).codes
+    _thresholds = (star_scores, table)
+    return table
+
+
+def star_tables(max_score_by_level, star_scores):
+    # Étoiles obtenues par niveau et totaux par scénario, à partir des scores
+    # maximum du joueur et des seuils d'étoiles du catalogue des niveaux
+    thresholds = threshold_table(star_scores)
+    # Jointure des seuils et des scores maximum du joueur sur le niveau ; score
+    # introuvable (NaN) : aucune comparaison n'est vraie, 0 étoile
+    max_scores = pd.Series(max_score_by_level, dtype="float64")
+    scores = max_scores.reindex(thresholds["Level"]).to_numpy()
+    player_stars = np.select(
+        [
+            scores >= thresholds["three_stars"].to_numpy(),
+            scores >= thresholds["two_stars"].to_numpy(),
+        ],
+        [3, 2],
+        default=0,
+    )
+    df_player_stars = pd.DataFrame(
+        {
+            "Scénario": thresholds["Scénario"].to_numpy(),
+            "Level": thresholds["Level"].to_numpy(),
+            PLAYER_STARS: player_stars,
+        }
+    )
+
+    # Tous les scénarios du catalogue, même sans niveau ou sans étoile
+    scenarios = list(star_scores)
+    scenario_stars = np.bincount(
+        thresholds["scenario_code"].to_numpy(), weights=player_stars, minlength=len(scenarios)
+    )
+    df_total_stars = pd.DataFrame(
+        {
+            "Scénario": scenarios,
+            TOTAL_STARS: [len(star_scores[scenario]) * STARS_PER_LEVEL for scenario in scenarios],
+            PLAYER_STARS: scenario_stars.astype("int64"),
+        }
+    )
+    return df_player_stars, df_total_stars
@@ -0,0 +1,284 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from level_stats import LevelStatsAccumulator
+from lrs_request import iter_lrs_statements
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+STORE_PATH = os.path.join(CACHE_DIR, "statements.sqlite")
+SYNC_OVERLAP = timedelta(seconds=1)  # Marge de recouvrement, les doublons sont ignorés
+BATCH_SIZE = 500
+# Écart toléré entre la date d'un statement (timestamp) et sa date
+# d'enregistrement (stored), sur laquelle portent les requêtes du LRS
+WINDOW_MARGIN = timedelta(minutes=10)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    id TEXT PRIMARY KEY,
+    agent TEXT NOT NULL,
+    stored TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS statements_agent_stored ON statements (agent, stored);
+CREATE TABLE IF NOT EXISTS aggregates (
+    agent TEXT PRIMARY KEY,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    agent TEXT PRIMARY KEY,
+    last_stored TEXT,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+def normalize_timestamp(value):
+    # Format ISO 8601 en UTC à largeur fixe, comparable comme une chaîne
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def stored_window(since=None, until=None):
+    # Une période porte sur la date des statements (timestamp), le LRS et le
+    # cache filtrent sur leur date d'enregistrement (stored), un peu plus
+    # tardive et donnée par une autre horloge : les bornes sont élargies de
+    # WINDOW_MARGIN, process_data applique ensuite la période exacte
+    def shift(value, delta):
+        if value is None:
+            return None
+        parsed = datetime.strptime(normalize_timestamp(value), "%Y-%m-%dT%H:%M:%S.%fZ")
+        return (parsed + delta).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    return shift(since, -WINDOW_MARGIN), shift(until, WINDOW_MARGIN)
+
+
+class StatementStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def connection(self):
+        # Une connexion par opération : les callbacks Dash tournent dans plusieurs threads
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def sync_state(self, agent_name):
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT last_stored, synced_at FROM sync_state WHERE agent = ?",
+                (agent_name,),
+            ).fetchone()
+        return row
+
+    def is_known(self, agent_name):
+        return self.sync_state(agent_name) is not None
+
+    def sync(self, agent_name, client=None, accumulator=None, on_page=None):
+        # Récupère seulement les statements enregistrés depuis la dernière
+        # synchronisation et les ajoute au cache, dédoublonnés par id. Les
+        # nouveaux statements sont aussi ajoutés à l'accumulateur s'il est donné.
+        state = self.sync_state(agent_name)
+        last_stored = state[0] if state else None
+        since = None
+        if last_stored is not None:
+            since = datetime.strptime(last_stored, "%Y-%m-%dT%H:%M:%S.%fZ")
+            since = (since - SYNC_OVERLAP).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+        # Les nouveaux statements sont plus récents que ceux déjà comptés : ils
+        # sont accumulés à part puis placés devant (prepend)
+        newer = None if accumulator is None else LevelStatsAccumulator()
+        with self.connection() as connection:
+            inserted, newest = self._ingest(
+                connection,
+                iter_lrs_statements(agent_name, since=since, client=client, on_page=on_page),
+                agent_name,
+                newer,
+            )
+            if newest is not None and (last_stored is None or newest > last_stored):
+                last_stored = newest
+            if accumulator is not None:
+                accumulator.prepend(newer)
+
+            if accumulator is None and inserted:
+                # Les statistiques enregistrées ne tiennent pas compte des
+                # nouveaux statements, elles seront recalculées
+                connection.execute("DELETE FROM aggregates WHERE agent = ?", (agent_name,))
+
+            # L'état n'est mis à jour qu'une fois toutes les pages récupérées,
+            # une synchronisation interrompue sera donc reprise depuis le début
+            connection.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                (agent_name, last_stored, time.time()),
+            )
+        return inserted
+
+    def fetch_window(self, agent_name, since=None, until=None, client=None, on_page=None):
+        # Statements d'une période seulement (bornes sur la date
+        # d'enregistrement), pour un joueur pas encore synchronisé. Ils sont
+        # ajoutés au cache sans toucher à sync_state : le joueur reste inconnu,
+        # sa première synchronisation demandera tout l'historique et les
+        # doublons seront ignorés.
+        with self.connection() as connection:
+            inserted, _ = self._ingest(
+                connection,
+                iter_lrs_statements(
+                    agent_name, since=since, until=until, client=client, on_page=on_page
+                ),
+                agent_name,
+            )
+            if inserted:
+                connection.execute("DELETE FROM aggregates WHERE agent = ?", (agent_name,))
+        return inserted
+
+    def _ingest(self, connection, statements, agent_name, accumulator=None):
+        # Ajoute les statements reçus du LRS par lots de BATCH_SIZE. Renvoie le
+        # nombre de statements insérés et la date d'enregistrement la plus
+        # récente rencontrée (None sans statement).
+        inserted = 0
+        last_stored = None
+        batch = []
+        for statement in statements:
+            stored = normalize_timestamp(statement.get("stored") or statement["timestamp"])
+            if last_stored is None or stored > last_stored:
+                last_stored = stored
+            batch.append((statement["id"], agent_name, stored, statement))
+            if len(batch) >= BATCH_SIZE:
+                inserted += self.insert(connection, batch, accumulator)
+                batch = []
+        inserted += self.insert(connection, batch, accumulator)
+        return inserted, last_stored
+
+    def insert(self, connection, batch, accumulator=None):
+        if not batch:
+            return 0
+        ids = [row[0] for row in batch]
+        known = {
+            row[0]
+            for row in connection.execute(
+                f"SELECT id FROM statements WHERE id IN ({','.join('?' * len(ids))})",
+                ids,
+            )
+        }
+        new_rows = []
+        for statement_id, agent_name, stored, statement in batch:
+            if statement_id in known:
+                continue
+            known.add(statement_id)
+            # JSON sans espaces : les statements réduits restent compacts sur disque
+            payload = json.dumps(statement, separators=(",", ":"))
+            new_rows.append((statement_id, agent_name, stored, payload))
+            if accumulator is not None:
+                accumulator.add(statement)
+        connection.executemany("INSERT INTO statements VALUES (?, ?, ?, ?)", new_rows)
+        connection.commit()
+        return len(new_rows)
+
+    def iter_statements(self, agent_name, since=None, until=None):
+        # Même ordre que le LRS : du plus récent au plus ancien. since (exclu)
+        # et until (inclus) bornent la date d'enregistrement, comme pour le
+        # LRS, et utilisent l'index (agent, stored)
+        query = "SELECT payload FROM statements WHERE agent = ?"
+        params = [agent_name]
+        if since is not None:
+            query += " AND stored > ?"
+            params.append(normalize_timestamp(since))
+        if until is not None:
+            query += " AND stored <= ?"
+            params.append(normalize_timestamp(until))
+        with self.connection() as connection:
+            cursor = connection.execute(query + " ORDER BY stored DESC, rowid", params)
+            while True:
+                rows = cursor.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                for (payload,) in rows:
+                    yield json.loads(payload)
+
+    def save_aggregates(self, agent_name, accumulator):
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO aggregates VALUES (?, ?)",
+                (agent_name, accumulator.to_json()),
+            )
+
+    def load_aggregates(self, agent_name):
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT payload FROM aggregates WHERE agent = ?", (agent_name,)
+            ).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        if "pending" not in data:
+            # Format antérieur, sans les statements en attente de niveau : les
+            # statistiques seront recalculées sur tout l'historique
+            return None
+        return LevelStatsAccumulator.from_dict(data)
+
+    def sync_aggregates(self, agent_name, client=None, on_page=None):
+        # Synchronise le joueur et met à jour ses statistiques avec les seuls
+        # nouveaux statements, dans l'ordre où le LRS les renvoie
+        accumulator = self.load_aggregates(agent_name)
+        if accumulator is None:
+            # Pas encore de statistiques : synchronisation puis passage complet
+            # sur le cache, qui peut déjà contenir des statements d'une période
+            # (fetch_window) que sync n'ajouterait pas à l'accumulateur
+            self.sync(agent_name, client=client, on_page=on_page)
+            accumulator = LevelStatsAccumulator().update(self.iter_statements(agent_name))
+        else:
+            try:
+                self.sync(
+                    agent_name, client=client, accumulator=accumulator, on_page=on_page
+                )
+            except BaseException:
+                # Statements peut-être déjà insérés sans être comptés : les
+                # statistiques seront recalculées au prochain appel
+                with self.connection() as connection:
+                    connection.execute("DELETE FROM aggregates WHERE agent = ?", (agent_name,))
+                raise
+        self.save_aggregates(agent_name, accumulator)
+        return accumulator
+
+    def aggregates(self, agent_name):
+        # Statistiques enregistrées, ou calculées sur tout le cache (puis
+        # enregistrées) si la dernière synchronisation a échoué
+        accumulator = self.load_aggregates(agent_name)
+        if accumulator is None:
+            accumulator = LevelStatsAccumulator().update(self.iter_statements(agent_name))
+            self.save_aggregates(agent_name, accumulator)
+        return accumulator
+
+    def count(self, agent_name):
+        with self.connection() as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM statements WHERE agent = ?", (agent_name,)
+            ).fetchone()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # Cache partagé par tous les callbacks du tableau de bord
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StatementStore()
+        return _store
@@ -0,0 +1,143 @@
+import argparse
+import heapq
+import json
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from lrs_request import CONTEXT_EXTENSION, PROGRESS_EXTENSION, SCORE_EXTENSION
+from score import get_level_catalog
+
+HOME_PAGE = "https://www.lip6.fr/mocah/"
+VERB_PREFIX = "http://adlnet.gov/expapi/verbs/"
+LEVEL_ACTIVITY = "https://spy.lip6.fr/xapi/activities/level"
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+# Niveaux utilisés si le catalogue des niveaux est vide
+DEFAULT_LEVELS = {
+    scenario: {f"Niveau{i:02d}": (3000, 6000) for i in range(1, 21)}
+    for scenario in ("Infiltration", "Explorateur", "Repetiteur", "Collaborateur")
+}
+ACTIONS = ["executed", "moved", "moved", "moved", "interacted"]
+LEVEL_DETAIL = 0.6  # Part des actions qui répètent le niveau dans leurs extensions
+SUCCESS_RATE = 0.6  # Part des essais terminés par "completed"
+NEW_SESSION = 0.02  # Probabilité qu'un essai commence une nouvelle séance
+STORE_DELAY = timedelta(milliseconds=50)  # Délai d'enregistrement par le LRS
+
+
+def level_extensions(mission_level, scenario):
+    return {
+        "extensions": {
+            PROGRESS_EXTENSION: [mission_level],
+            CONTEXT_EXTENSION: [scenario],
+        }
+    }
+
+
+def make_statement(rng, player, verb, timestamp, definition=None, score=None):
+    statement = {
+        "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "actor": {
+            "objectType": "Agent",
+            "name": player,
+            "account": {"homePage": HOME_PAGE, "name": player},
+        },
+        "verb": {"id": VERB_PREFIX + verb, "display": {"en-US": verb}},
+        "object": {"objectType": "Activity", "id": LEVEL_ACTIVITY},
+        "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        # Le LRS enregistre le statement un peu après sa création
+        "stored": (timestamp + STORE_DELAY).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "result": {"success": score is not None},
+    }
+    if definition is not None:
+        statement["object"]["definition"] = definition
+    if score is not None:
+        statement["result"]["extensions"] = {SCORE_EXTENSION: [str(score)]}
+    return statement
+
+
+def attempt_steps(rng, levels):
+    # Un essai sur un niveau : "launched", des actions (souvent sans niveau,
+    # reporté depuis le statement précédent), puis "completed" avec un score
+    # ou "exited". Les dates sont des décalages depuis le début de l'essai.
+    scenario = rng.choice(list(levels))
+    level, (two_stars, three_stars) = rng.choice(list(levels[scenario].items()))
+    definition = level_extensions(level.replace("Niveau", "mission"), scenario)
+    offset = timedelta(0)
+    steps = [("launched", offset, definition, None)]
+    for _ in range(rng.randint(2, 15)):
+        offset += timedelta(seconds=rng.expovariate(1 / 8))
+        detail = definition if rng.random() < LEVEL_DETAIL else None
+        steps.append((rng.choice(ACTIONS), offset, detail, None))
+    offset += timedelta(seconds=rng.expovariate(1 / 10))
+    if rng.random() < SUCCESS_RATE:
+        # Scores répartis autour des seuils d'étoiles du niveau
+        score = max(0, int(rng.gauss((two_stars + three_stars) / 2, three_stars / 4)))
+        steps.append(("completed", offset, definition, score))
+    else:
+        steps.append(("exited", offset, definition, None))
+    return steps
+
+
+def iter_player(count, player="Joueur", seed=0, levels=None):
+    # count statements réalistes d'un joueur SPY, du plus récent au plus ancien
+    # comme le LRS les renvoie. Les essais sont placés en remontant le temps,
+    # les statements sont donc produits au fur et à mesure, sans tout garder
+    # en mémoire (10^6 statements et plus).
+    rng = random.Random(f"{player}/{seed}")
+    levels = levels or get_level_catalog() or DEFAULT_LEVELS
+    levels = {scenario: scores for scenario, scores in levels.items() if scores}
+    end = START + timedelta(days=365)
+    produced = 0
+    while produced < count:
+        steps = attempt_steps(rng, levels)
+        start = end - steps[-1][1]
+        for verb, offset, definition, score in reversed(steps):
+            yield make_statement(rng, player, verb, start + offset, definition, score)
+            produced += 1
+            if produced >= count:
+                return
+        # Pause avant cet essai, parfois une séance précédente un autre jour
+        if rng.random() < NEW_SESSION:
+            gap = rng.uniform(12 * 3600, 3 * 86400)
+        else:
+            gap = rng.expovariate(1 / 30)
+        end = start - timedelta(seconds=gap)
+
+
+def iter_statements(count, seed=0, players=1, levels=None):
+    # Statements de plusieurs joueurs mélangés, du plus récent au plus ancien
+    if players == 1:
+        return iter_player(count, seed=seed, levels=levels)
+    streams = [
+        iter_player(
+            count // players + (1 if i < count % players else 0),
+            player=f"Joueur{i:03d}",
+            seed=seed,
+            levels=levels,
+        )
+        for i in range(players)
+    ]
+    return heapq.merge(
+        *streams, key=lambda statement: statement["stored"], reverse=True
+    )
+
+
+def generate_statements(count, seed=0, players=1, levels=None):
+    return list(iter_statements(count, seed, players, levels))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Génère des statements xAPI SPY synthétiques (une ligne JSON par statement)"
+    )
+    parser.add_argument("count", type=int, help="Nombre de statements (10^3 à 10^6)")
+    parser.add_argument("--players", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for statement in iter_statements(args.count, args.seed, args.players):
+        sys.stdout.write(json.dumps(statement) + "\n")
+
+
+if __name__ == "__main__":
+    main()
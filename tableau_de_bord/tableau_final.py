@@ -1,13 +1,123 @@
-import os
+import time
+
+# Début du démarrage, pour mesurer aussi la durée des imports
+STARTED = time.perf_counter()
+
 import dash
-from dash import dcc, html
+from dash import ctx, dcc, html
 import plotly.express as px
 from dash.dependencies import Input, Output, State
 import pandas as pd
-from lrs_request import fetch_lrs_data, process_data, calculate_time_per_level
-from score import extract_scores
+from lrs_request import process_data
+from lrs_client import LRSError
+from statement_store import get_store, stored_window
+from level_stats import build_level_cube
+from data_cache import get_data_cache
+from jobs import get_job_manager
+import uuid
+import base64
+from datetime import datetime, timedelta, timezone
+from score import get_level_catalog
+from stars import star_tables
+from cohort import build_cohort, load_cohort, parse_agent_names, summarize_cohort
+import os
+import flask
+import metrics
+import profiling
+from snapshot import has_snapshot, level_aggregates, load_cube, load_statements
+from schema import in_window, timestamp_ticks
+from figures import COHORT_LAYOUT, figure_layout, level_bar, level_bar_patch
+import warmup
+
+warmup.record("imports", time.perf_counter() - STARTED)
+
+# flask-compress est facultatif : s'il est installé, les réponses (figures
+# JSON des callbacks, scripts) sont compressées en brotli ou gzip selon
+# l'en-tête Accept-Encoding du navigateur
+try:
+    import flask_compress
+except ImportError:
+    flask_compress = None
+
+# Avec SPY_SNAPSHOT_DIR, les joueurs exportés par snapshot.py sont lus depuis
+# leurs instantanés, sans interroger le LRS
+USE_SNAPSHOTS = bool(os.environ.get("SPY_SNAPSHOT_DIR"))
+
+app = dash.Dash(
+    __name__,
+    external_stylesheets=["/assets/style.css"],
+    compress=flask_compress is not None,
+)
+# Application WSGI pour un serveur de production (voir wsgi.py)
+server = app.server
+
+
+@app.server.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@app.server.after_request
+def record_request_metrics(response):
+    # Les réponses des callbacks contiennent les figures et les dcc.Store
+    # sérialisés en JSON : leur durée et leur taille s'ajoutent aux métriques
+    if flask.request.path.endswith("_dash-update-component"):
+        metrics.observe(
+            "spy_dash_update_duration_seconds",
+            time.perf_counter() - flask.g.request_start,
+        )
+        metrics.increment(
+            "spy_dash_response_bytes_total", response.calculate_content_length() or 0
+        )
+    return response
+
+
+@app.server.route("/metrics")
+def metrics_route():
+    return flask.Response(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+metrics.gauge(
+    "spy_data_cache_entries",
+    "Entrées du cache des données traitées",
+    lambda: len(get_data_cache()),
+)
+metrics.gauge(
+    "spy_data_cache_bytes",
+    "Mémoire estimée du cache des données traitées",
+    lambda: get_data_cache().size,
+)
+metrics.gauge(
+    "spy_jobs",
+    "Chargements en arrière-plan par état",
+    lambda: get_job_manager().status_counts(),
+)
 
-app = dash.Dash(__name__, external_stylesheets=["/assets/style.css"])
+# Graphiques construits par level_bar, mis à jour partiellement
+LEVEL_GRAPHS = [
+    "graph-avg-score",
+    "graph-max-score",
+    "graph-completed-counts",
+    "graph-time-spent",
+]
+
+# Périodes proposées : durée jusqu'au moment du chargement, None pour tout
+# l'historique. La période est transmise au LRS (since/until), seuls les
+# statements concernés sont transférés et traités.
+PERIODS = {
+    "Tout l'historique": None,
+    "Séance en cours (3 dernières heures)": timedelta(hours=3),
+    "Dernières 24 heures": timedelta(days=1),
+    "7 derniers jours": timedelta(days=7),
+    "30 derniers jours": timedelta(days=30),
+}
+DEFAULT_PERIOD = "Tout l'historique"
+
+# Catalogue des seuils d'étoiles construit au démarrage puis gardé en cache
+with warmup.phase("level_catalog"):
+    get_level_catalog()
 
 app.layout = html.Div(
     children=[
@@ -15,6 +125,12 @@ app.layout = html.Div(
             children="Tableau de Bord des métriques essentielles du joueur par niveau"
         ),
         dcc.Store(id="data-store"),
+        # Graphiques par niveau déjà construits dans le navigateur : les mises
+        # à jour suivantes n'envoient que les valeurs modifiées (Patch)
+        *[dcc.Store(id=f"{graph}-drawn") for graph in LEVEL_GRAPHS],
+        dcc.Store(id="job-store"),
+        # Interroge l'avancement du chargement en cours, désactivé sinon
+        dcc.Interval(id="job-poll", interval=500, disabled=True),
         html.Div(
             children=[
                 dcc.Input(
@@ -24,17 +140,20 @@ app.layout = html.Div(
                     style={"margin-right": "10px"},
                 ),
                 html.Button("Entrer", id="submit-button", n_clicks=0),
-                dcc.Loading(
-                    id="loading-scenario-dropdown",
-                    type="circle",  # Vous pouvez utiliser "default", "circle", ou "dot"
-                    children=[
-                        dcc.Dropdown(
-                            id="menu-deroulant-scenario",
-                            options=[],  # Les options seront mises à jour dynamiquement
-                            placeholder="Sélectionner un scénario",
-                            style={"width": "50%", "margin-top": "20px"},
-                        )
-                    ],
+                dcc.Dropdown(
+                    id="menu-deroulant-periode",
+                    options=[{"label": period, "value": period} for period in PERIODS],
+                    value=DEFAULT_PERIOD,
+                    clearable=False,
+                    style={"width": "50%", "margin": "10px auto 0"},
+                ),
+                html.Div(id="lrs-status", style={"color": "red", "margin-top": "10px"}),
+                html.Div(id="job-progress", style={"margin-top": "10px"}),
+                dcc.Dropdown(
+                    id="menu-deroulant-scenario",
+                    options=[],  # Les options seront mises à jour dynamiquement
+                    placeholder="Sélectionner un scénario",
+                    style={"width": "50%", "margin-top": "20px"},
                 ),
             ],
             style={"text-align": "center", "margin-bottom": "20px"},
@@ -86,337 +205,688 @@ app.layout = html.Div(
                 )
             ],
         ),
+        html.H2(children="Cohorte : métriques de tout un groupe de joueurs"),
+        dcc.Store(id="cohort-store"),
+        dcc.Store(id="cohort-job-store"),
+        dcc.Interval(id="cohort-poll", interval=1000, disabled=True),
+        html.Div(
+            children=[
+                dcc.Textarea(
+                    id="cohort-input",
+                    placeholder="Noms des joueurs (un par ligne ou séparés par des virgules)",
+                    style={"width": "50%", "height": "100px"},
+                ),
+                dcc.Upload(
+                    id="cohort-upload",
+                    children=html.Button("Importer une liste (CSV, TXT)"),
+                    style={"margin-top": "10px"},
+                ),
+                html.Button(
+                    "Analyser la cohorte",
+                    id="cohort-button",
+                    n_clicks=0,
+                    style={"margin-top": "10px"},
+                ),
+                html.Div(id="cohort-status", style={"color": "red", "margin-top": "10px"}),
+                html.Div(id="cohort-progress", style={"margin-top": "10px"}),
+                dcc.Dropdown(
+                    id="menu-deroulant-cohort-scenario",
+                    options=[],
+                    placeholder="Sélectionner un scénario",
+                    style={"width": "50%", "margin-top": "20px"},
+                ),
+            ],
+            style={"text-align": "center", "margin-bottom": "20px"},
+        ),
+        html.Div(
+            className="graph-container",
+            children=[
+                dcc.Graph(id="graph-cohort-scores"),
+                dcc.Graph(id="graph-cohort-completion"),
+                dcc.Graph(id="graph-cohort-stars"),
+            ],
+            style={"display": "flex", "flex-direction": "column"},
+        ),
         html.Script(src="/assets/script.js"),
     ]
 )
 
 
+def load_snapshot_data(username, since=None, until=None):
+    # Table et agrégats relus depuis l'instantané, sans retraiter les statements
+    df = load_statements(players=[username]).drop(columns="Player")
+    if since is not None or until is not None:
+        # Les agrégats de l'instantané couvrent tout l'historique : ils sont
+        # recalculés sur la période
+        ticks, nanoseconds_per_tick, has_time = timestamp_ticks(df["Timestamp"])
+        df = df[has_time & in_window(ticks, nanoseconds_per_tick, since, until)]
+        df = df.reset_index(drop=True)
+    (
+        all_mission_levels,
+        completed_counts,
+        avg_score_by_level,
+        max_score_by_level,
+    ) = level_aggregates(df)
+    return {
+        "df": df,
+        "all_mission_levels": all_mission_levels,
+        "completed_counts": completed_counts,
+        "avg_score_by_level": avg_score_by_level,
+        "max_score_by_level": max_score_by_level,
+        "cube": (
+            load_cube(username)
+            if since is None and until is None
+            else build_level_cube(df)
+        ),
+    }
+
+
+def load_player_data(username, job=None, since=None, until=None):
+    if USE_SNAPSHOTS and has_snapshot(username):
+        return load_snapshot_data(username, since, until)
+    # Historique du joueur enregistré dans le cache local, limité à la période
+    # (bornes sur la date d'enregistrement, élargies d'une marge). Le LRS
+    # n'est jamais interrogé ici : load_player_job a déjà rempli le cache.
+    store = get_store()
+    accumulator = None
+    if since is None and until is None:
+        # Statistiques par niveau tenues à jour par sync_aggregates, None si
+        # la dernière synchronisation a échoué
+        accumulator = store.load_aggregates(username)
+    statements = store.iter_statements(username, *stored_window(since, until))
+    if job is not None:
+        statements = job.track(statements, "processed")
+    return build_player_data(statements, since, until, accumulator)
+
+
+def build_player_data(statements, since=None, until=None, accumulator=None):
+    (
+        df,
+        all_mission_levels,
+        completed_counts,
+        avg_score_by_level,
+        max_score_by_level,
+    ) = process_data(statements, since, until)
+    return {
+        "df": df,
+        "all_mission_levels": all_mission_levels,
+        "completed_counts": completed_counts,
+        "avg_score_by_level": avg_score_by_level,
+        "max_score_by_level": max_score_by_level,
+        "cube": build_level_cube(df, accumulator),
+    }
+
+
+def get_player_data(store_data):
+    # Données du joueur en mémoire ; si elles ont été évincées du cache, elles
+    # sont reconstruites depuis le cache local des statements, sur la même période
+    return get_data_cache().get_or_build(
+        store_data["key"],
+        lambda: load_player_data(
+            store_data["username"],
+            since=store_data.get("since"),
+            until=store_data.get("until"),
+        ),
+    )
+
+
+def period_window(period):
+    # Bornes (since, until) de la période choisie, en dates ISO 8601 UTC
+    duration = PERIODS.get(period)
+    if duration is None:
+        return None, None
+    now = datetime.now(timezone.utc)
+    return (now - duration).strftime("%Y-%m-%dT%H:%M:%S.%fZ"), None
+
+
+def load_player_job(job, username, since=None, until=None):
+    # Chargement exécuté en arrière-plan : seuls les nouveaux statements sont
+    # demandés au LRS, le reste de l'historique est lu depuis le cache local
+    store = get_store()
+    status = ""
+    windowed = since is not None or until is not None
+    # Un joueur lu depuis son instantané n'est pas synchronisé
+    if not (USE_SNAPSHOTS and has_snapshot(username)):
+        on_page = lambda pages, fetched: job.report(pages=pages, fetched=fetched)
+        try:
+            if windowed and not store.is_known(username):
+                # Joueur inconnu du cache : seule la période est demandée au
+                # LRS au lieu de tout son historique
+                store.fetch_window(username, *stored_window(since, until), on_page=on_page)
+            else:
+                # Les statistiques par niveau enregistrées ne sont mises à
+                # jour qu'avec les nouveaux statements
+                store.sync_aggregates(username, on_page=on_page)
+        except LRSError as e:
+            # Le LRS ne répond pas : on l'indique sans bloquer le tableau de bord
+            print(e)
+            if not store.is_known(username):
+                return (
+                    [],
+                    None,
+                    "Impossible de récupérer les données du LRS, réessayez plus tard.",
+                )
+            status = "LRS indisponible, affichage des données en cache."
+    player_data = load_player_data(username, job, since, until)
+    # Le navigateur ne garde que la clé des données, les DataFrames restent
+    # en mémoire sur le serveur
+    key = f"{username}/{uuid.uuid4().hex}"
+    get_data_cache().put(key, player_data)
+    store_data = {"key": key, "username": username, "since": since, "until": until}
+    df = player_data["df"]
+    scenarios = df["Scenario"].dropna().unique()
+    scenarios = [
+        scenario for scenario in scenarios if not scenario.startswith(("erty", "plok"))
+    ]
+    scenario_options = [{"label": scenario, "value": scenario} for scenario in scenarios]
+    return scenario_options, store_data, status
+
+
+def progress_text(progress):
+    parts = []
+    if "pages" in progress:
+        parts.append(
+            f"{progress['pages']} page(s) reçue(s) du LRS, "
+            f"{progress['fetched']} statement(s)"
+        )
+    if "processed" in progress:
+        parts.append(f"{progress['processed']} statement(s) traité(s)")
+    return "Chargement en cours... " + " — ".join(parts)
+
+
 @app.callback(
-    [Output("menu-deroulant-scenario", "options"), Output("data-store", "data")],
-    [Input("submit-button", "n_clicks")],
-    [State("username-input", "value")],
+    Output("job-store", "data"),
+    [Input("submit-button", "n_clicks"), Input("menu-deroulant-periode", "value")],
+    [State("username-input", "value"), State("job-store", "data")],
 )
-def update_scenario_options(n_clicks, username):
-    if not username:
-        return [], None
-    if n_clicks > 0:
-        data = fetch_lrs_data(username)
-        (
-            df,
-            all_mission_levels,
-            completed_counts,
-            avg_score_by_level,
-            max_score_by_level,
-        ) = process_data(data)
-        store_data = {
-            "df": df.to_dict("records"),
-            "all_mission_levels": all_mission_levels,
-            "completed_counts": completed_counts,
-            "avg_score_by_level": avg_score_by_level,
-            "max_score_by_level": max_score_by_level,
-        }
-        scenarios = df["Scenario"].dropna().unique()
-        scenarios = [
-            scenario
-            for scenario in scenarios
-            if not scenario.startswith(("erty", "plok"))
-        ]
-        scenario_options = [
-            {"label": scenario, "value": scenario} for scenario in scenarios
-        ]
-        return scenario_options, store_data
-    return [], None
+@metrics.timed_callback
+@profiling.profiled
+def submit_username(n_clicks, period, username, job_data):
+    # Un nouveau nom d'utilisateur ou une nouvelle période annule le
+    # chargement précédent
+    manager = get_job_manager()
+    if job_data:
+        manager.cancel(job_data["job"])
+    if not username or not n_clicks:
+        return None
+    # La période est fixée au moment de la demande
+    since, until = period_window(period)
+    job = manager.submit(
+        profiling.when_requested(load_player_job), username, since, until
+    )
+    return {"job": job.id}
 
 
 @app.callback(
     [
-        Output("graph-avg-score", "figure"),
-        Output("graph-max-score", "figure"),
-        Output("graph-completed-counts", "figure"),
-        Output("graph-time-spent", "figure"),
+        Output("menu-deroulant-scenario", "options"),
+        Output("data-store", "data"),
+        Output("lrs-status", "children"),
+        Output("job-progress", "children"),
+        Output("job-poll", "disabled"),
     ],
-    # Output('graph-2stars', 'figure'),
-    # Output('graph-3stars', 'figure'),
-    # Output('graph-combined1', 'figure'),
-    # Output('graph-combined2', 'figure'),
-    Output(
-        "graph-total-stars", "figure"
-    ),  # New output for Nombre d\'étoiles total par scénario graph
-    Output(
-        "graph-player-stars", "figure"
-    ),  # New output for Nombre d\'étoiles du joueur par scénario graph
-    [
-        Input("menu-deroulant-scenario", "value"),
-        Input("menu-deroulant-time-spent", "value"),
-        Input("data-store", "data"),
-    ],
-    [State("username-input", "value")],
+    [Input("job-poll", "n_intervals"), Input("job-store", "data")],
 )
-def update_graphs(selected_scenario, selected_time_spent, data, username):
-    if not username or not selected_scenario:
-        return {}, {}, {}, {}, {}, {}
-
-    # data = fetch_lrs_data(username)
-    # df, all_mission_levels, completed_counts, avg_score_by_level, max_score_by_level = (
-    #     process_data(data)
-    # )
-
-    df = pd.DataFrame(data["df"])
-    all_mission_levels = data["all_mission_levels"]
-    completed_counts = data["completed_counts"]
-    avg_score_by_level = data["avg_score_by_level"]
-    max_score_by_level = data["max_score_by_level"]
-
-    df = df[df["Scenario"] == selected_scenario]
-    # print(f"df colmuns : {df.columns}")
-    df["Timestamp"] = pd.to_datetime(df["Timestamp"])
-
-    time_spent_max, time_spent_min, time_spent_avg = calculate_time_per_level(df)
-
-    # Arrondir les valeurs des dictionnaires à 3 décimales
-    time_spent_max = {k: round(v, 3) for k, v in time_spent_max.items()}
-    time_spent_min = {k: round(v, 3) for k, v in time_spent_min.items()}
-    time_spent_avg = {k: round(v, 3) for k, v in time_spent_avg.items()}
-
-    df_time_spent_max = pd.DataFrame(
-        list(time_spent_max.items()),
-        columns=["Mission Level", "Temps passé maximum par niveau"],
-    )
-    df_time_spent_min = pd.DataFrame(
-        list(time_spent_min.items()),
-        columns=["Mission Level", "Temps passé minimum par niveau"],
-    )
-    df_time_spent_avg = pd.DataFrame(
-        list(time_spent_avg.items()),
-        columns=["Mission Level", "Temps moyen passé par niveau"],
+@metrics.timed_callback
+@profiling.profiled
+def update_scenario_options(n_intervals, job_data):
+    if not job_data:
+        return [], None, "", "", True
+    job = get_job_manager().get(job_data["job"])
+    if job is None:
+        return [], None, "Chargement introuvable, réessayez.", "", True
+
+    if job.status in ("pending", "running"):
+        if ctx.triggered_id == "job-store":
+            # Nouveau chargement : on efface les données du joueur précédent
+            return [], None, "", progress_text(job.progress), False
+        return dash.no_update, dash.no_update, "", progress_text(job.progress), False
+    if job.status == "done":
+        scenario_options, store_data, status = job.result
+        return scenario_options, store_data, status, "", True
+    if job.status == "error":
+        print(job.error)
+        return [], None, "Erreur lors du chargement des données.", "", True
+    return dash.no_update, dash.no_update, "", "", True
+
+
+def scenario_level_stats(data, selected_scenario):
+    # Les agrégats du scénario ont été calculés au chargement des données
+    return get_player_data(data)["cube"].get(selected_scenario, {})
+
+
+def player_star_tables(player_data):
+    # Tables des étoiles calculées une fois par joueur et partagées par les deux
+    # graphiques d'étoiles, recalculées si le catalogue des niveaux change
+    star_scores = get_level_catalog()
+    cached = player_data.get("stars")
+    if cached is not None and cached[0] is star_scores:
+        metrics.cache_access("player_stars", hit=True)
+        return cached[1]
+    metrics.cache_access("player_stars", hit=False)
+
+    df_player_stars, df_total_stars = star_tables(
+        player_data["max_score_by_level"], star_scores
     )
+    player_data["stars"] = (star_scores, (df_player_stars, df_total_stars))
+    return df_player_stars, df_total_stars
+
+
+def level_figure(df, y, title, drawn):
+    # Figure complète au premier affichage ; ensuite, le navigateur garde la
+    # figure et ne reçoit que les nouvelles valeurs et les titres
+    with metrics.measure("figure"):
+        if drawn:
+            return level_bar_patch(df, y, title), True
+        return level_bar(df, y, title), True
+
+
+# Chaque graphique a son propre callback : changer de type de temps ne
+# recalcule que le graphique du temps passé, changer de scénario ne touche
+# pas aux graphiques d'étoiles.
+@app.callback(
+    [Output("graph-avg-score", "figure"), Output("graph-avg-score-drawn", "data")],
+    [Input("menu-deroulant-scenario", "value"), Input("data-store", "data")],
+    [State("username-input", "value"), State("graph-avg-score-drawn", "data")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_avg_score(selected_scenario, data, username, drawn):
+    if not username or not selected_scenario or not data:
+        return {}, None
+    level_stats = scenario_level_stats(data, selected_scenario)
+    avg_score_by_level = {
+        level: stats["avg_score"] for level, stats in level_stats.items()
+    }
 
     df_avg_score = pd.DataFrame(
         list(avg_score_by_level.items()), columns=["Mission Level", "Score moyen"]
     )
-    fig_avg_score = px.bar(
-        df_avg_score,
-        x="Mission Level",
-        y="Score moyen",
-        title="Score moyen par niveau",
-        text="Score moyen",
-    )
-    fig_avg_score.update_traces(texttemplate="%{text}", textposition="outside")
-    fig_avg_score.update_layout(
-        xaxis_title="Niveaux",
-        yaxis_title="Score moyen",
-        margin=dict(l=40, r=40, t=40, b=40),
-        yaxis=dict(tickmode="linear", dtick=1),
-    )
+    return level_figure(df_avg_score, "Score moyen", "Score moyen par niveau", drawn)
+
+
+@app.callback(
+    [Output("graph-max-score", "figure"), Output("graph-max-score-drawn", "data")],
+    [Input("menu-deroulant-scenario", "value"), Input("data-store", "data")],
+    [State("username-input", "value"), State("graph-max-score-drawn", "data")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_max_score(selected_scenario, data, username, drawn):
+    if not username or not selected_scenario or not data:
+        return {}, None
+    level_stats = scenario_level_stats(data, selected_scenario)
+    max_score_by_level = {
+        level: stats["max_score"] for level, stats in level_stats.items()
+    }
 
     df_max_score = pd.DataFrame(
-        list(max_score_by_level.items()), columns=["Mission Level", "Score maximum"]
-    )
-    fig_max_score = px.bar(
-        df_max_score,
-        x="Mission Level",
-        y="Score maximum",
-        title="Score max par niveau",
-        text="Score maximum",
-    )
-    fig_max_score.update_traces(texttemplate="%{text}", textposition="outside")
-    fig_max_score.update_layout(
-        xaxis_title="Niveaux",
-        yaxis_title="Score maximum",
-        margin=dict(l=40, r=40, t=40, b=40),
-        yaxis=dict(tickmode="linear", dtick=1),
+        list(max_score_by_level.items()),
+        columns=["Mission Level", "Score maximum"],
     )
+    return level_figure(df_max_score, "Score maximum", "Score max par niveau", drawn)
+
+
+@app.callback(
+    [Output("graph-completed-counts", "figure"), Output("graph-completed-counts-drawn", "data")],
+    [Input("menu-deroulant-scenario", "value"), Input("data-store", "data")],
+    [State("username-input", "value"), State("graph-completed-counts-drawn", "data")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_completed_counts(selected_scenario, data, username, drawn):
+    if not username or not selected_scenario or not data:
+        return {}, None
+    level_stats = scenario_level_stats(data, selected_scenario)
+    completed_counts = {
+        level: stats["completions"]
+        for level, stats in level_stats.items()
+        if stats["completions"] > 0
+    }
 
     df_completed_counts = pd.DataFrame(
         list(completed_counts.items()), columns=["Mission Level", "Nombre d'essais"]
     )
-    fig_completed_counts = px.bar(
-        df_completed_counts,
-        x="Mission Level",
-        y="Nombre d'essais",
-        title="Nombre de niveaux complétés",
-        text="Nombre d'essais",
+    return level_figure(
+        df_completed_counts, "Nombre d'essais", "Nombre de niveaux complétés", drawn
     )
-    fig_completed_counts.update_traces(texttemplate="%{text}", textposition="outside")
-    fig_completed_counts.update_layout(
-        xaxis_title="Niveaux",
-        yaxis_title="Nombre d'essais",
-        margin=dict(l=40, r=40, t=40, b=40),
-        yaxis=dict(tickmode="linear", dtick=1),
+
+
+# Statistique du cube affichée pour chaque type de temps passé
+TIME_SPENT_KEYS = {
+    "Temps passé maximum par niveau": "time_max",
+    "Temps passé minimum par niveau": "time_min",
+    "Temps moyen passé par niveau": "time_avg",
+}
+
+
+@app.callback(
+    [Output("graph-time-spent", "figure"), Output("graph-time-spent-drawn", "data")],
+    [
+        Input("menu-deroulant-scenario", "value"),
+        Input("menu-deroulant-time-spent", "value"),
+        Input("data-store", "data"),
+    ],
+    [State("username-input", "value"), State("graph-time-spent-drawn", "data")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_time_spent(selected_scenario, selected_time_spent, data, username, drawn):
+    if not username or not selected_scenario or not data:
+        return {}, None
+    level_stats = scenario_level_stats(data, selected_scenario)
+    key = TIME_SPENT_KEYS[selected_time_spent]
+
+    # Arrondir les valeurs à 3 décimales
+    time_spent = {
+        level: round(stats[key], 3)
+        for level, stats in level_stats.items()
+        if stats[key] is not None
+    }
+    df_time_spent = pd.DataFrame(
+        list(time_spent.items()), columns=["Mission Level", selected_time_spent]
     )
+    return level_figure(df_time_spent, selected_time_spent, selected_time_spent, drawn)
 
-    if selected_time_spent == "Temps passé maximum par niveau":
-        fig_time_spent = px.bar(
-            df_time_spent_max,
-            x="Mission Level",
-            y="Temps passé maximum par niveau",
-            title="Temps passé maximum par niveau",
-            text="Temps passé maximum par niveau",
-        )
-    elif selected_time_spent == "Temps passé minimum par niveau":
-        fig_time_spent = px.bar(
-            df_time_spent_min,
-            x="Mission Level",
-            y="Temps passé minimum par niveau",
-            title="Temps passé minimum par niveau",
-            text="Temps passé minimum par niveau",
+
+@app.callback(
+    Output("graph-player-stars", "figure"),
+    [Input("data-store", "data")],
+    [State("username-input", "value")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_player_stars(data, username):
+    if not username or not data:
+        return {}
+    df_player_stars, df_total_stars = player_star_tables(get_player_data(data))
+
+    with metrics.measure("figure"):
+        fig_player_stars = px.bar(
+            df_player_stars,
+            x="Level",
+            y="Nombre d'étoiles du joueur par scénario",
+            color="Scénario",
+            title="Nombre d'étoiles obtenues par niveau",
+            text="Nombre d'étoiles du joueur par scénario",
         )
-    elif selected_time_spent == "Temps moyen passé par niveau":
-        fig_time_spent = px.bar(
-            df_time_spent_avg,
-            x="Mission Level",
-            y="Temps moyen passé par niveau",
-            title="Temps moyen passé par niveau",
-            text="Temps moyen passé par niveau",
+        fig_player_stars.update_traces(texttemplate="%{text}", textposition="inside")
+        fig_player_stars.update_layout(
+            **figure_layout("Niveaux", "Nombre d'étoiles obtenues")
         )
+    return fig_player_stars
 
-    fig_time_spent.update_traces(texttemplate="%{text}", textposition="outside")
-    fig_time_spent.update_layout(
-        xaxis_title="Niveaux",
-        yaxis_title=selected_time_spent,
-        margin=dict(l=40, r=40, t=40, b=40),
-        yaxis=dict(tickmode="linear", dtick=1),
-    )
 
-    # Extraire les scores des étoiles
-    base_dir = os.path.join("tableau_de_bord", "Levels", "Levels")
-    star_scores = extract_scores(base_dir)
-    # print("blabababa", star_scores)
-    star_data = []
-    player_star_data = []
-    # max_score_by_level = df['Score maximum'].to_dict()
-    # print("bbbbb",max_score_by_level)# Convert Series to dictionary for faster lookup
-    for Scénario, levels in star_scores.items():
-        for level, stars in levels.items():
-            transformed_level = level.replace("Niveau", "mission")
-            star_data.append(
-                {
-                    "Scénario": Scénario,
-                    "Level": transformed_level,
-                    "Score to get 2 Stars": stars[0],
-                    "Score to get 3 Stars": stars[1],
-                }
-            )
-            # Déterminer le nombre d'étoiles que le joueur a obtenues
-            max_score = max_score_by_level.get(transformed_level, None)
-
-            # Ajouter une vérification pour max_score
-            if max_score is not None:
-                player_stars = 0
-                if max_score >= stars[1]:
-                    player_stars = 3
-                elif max_score >= stars[0]:
-                    player_stars = 2
-            else:
-                # Si le score maximum est introuvable, attribuer 0 étoile
-                player_stars = 0
-
-            player_star_data.append(
-                {
-                    "Scénario": Scénario,
-                    "Level": transformed_level,
-                    "Nombre d'étoiles du joueur par scénario": player_stars,
-                }
+@app.callback(
+    Output("graph-total-stars", "figure"),
+    [Input("data-store", "data")],
+    [State("username-input", "value")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_total_stars(data, username):
+    if not username or not data:
+        return {}
+    df_player_stars, df_total_stars = player_star_tables(get_player_data(data))
+
+    # Create a graph comparing Nombre d\'étoiles du joueur par scénario to Nombre d\'étoiles total par scénario required
+    with metrics.measure("figure"):
+        fig_total_stars = px.bar(
+            df_total_stars,
+            x="Scénario",
+            y=[
+                "Nombre d'étoiles du joueur par scénario",
+                "Nombre d'étoiles total par scénario",
+            ],
+            barmode="group",
+            title="Progression du joueur en termes d'étoiles",
+            text_auto=True,
+        )
+
+        # Update the layout to differentiate the bars
+        fig_total_stars.update_traces(
+            marker=dict(line=dict(width=1.5, color="DarkSlateGrey"))
+        )
+        fig_total_stars.update_layout(
+            **figure_layout(
+                "Scénarios",
+                "Nombre d'étoiles",
+                legend_title_text="Type d'étoiles",
+                legend=dict(x=0.5, y=1.1, orientation="h", xanchor="center"),
             )
+        )
+    return fig_total_stars
+
 
-    df_stars = pd.DataFrame(star_data)
-    # print("bbbbbbb",player_star_data)
-    player_star_data = [
-        entry
-        for entry in player_star_data
-        if not (
-            entry["Scénario"] == "Infiltration"
-            and entry["Level"] in [f"mission0{i}" for i in range(1, 9)]
+def load_cohort_job(job, agent_names):
+    # Synchronisation des joueurs puis traitement réparti sur plusieurs processus
+    cohort = load_cohort(agent_names, on_progress=job.report)
+    key = f"cohort/{uuid.uuid4().hex}"
+    get_data_cache().put(key, cohort)
+    status = ""
+    if cohort["errors"]:
+        status = f"{len(cohort['errors'])} joueur(s) sans données : " + ", ".join(
+            cohort["errors"]
         )
+    scenarios = cohort["levels"]["Scenario"].dropna().unique()
+    scenarios = [
+        scenario for scenario in scenarios if not scenario.startswith(("erty", "plok"))
     ]
-    print("player_star_data", player_star_data)
-    df_player_stars = pd.DataFrame(
-        player_star_data
-    )  # New DataFrame for Nombre d\'étoiles du joueur par scénario
-    # print("blueblue",star_data)
-    df_stars = pd.DataFrame(star_data)
-
-    # print("greengreen", df_stars)
-
-    fig_player_stars = px.bar(
-        df_player_stars,
-        x="Level",
-        y="Nombre d'étoiles du joueur par scénario",
-        color="Scénario",
-        title="Nombre d'étoiles obtenues par niveau",
-        text="Nombre d'étoiles du joueur par scénario",
-    )
-    fig_player_stars.update_traces(texttemplate="%{text}", textposition="inside")
-    fig_player_stars.update_layout(
-        xaxis_title="Niveaux",
-        yaxis_title="Nombre d'étoiles obtenues",
-        margin=dict(l=40, r=40, t=40, b=40),
-        yaxis=dict(tickmode="linear", dtick=1),
+    scenario_options = [{"label": scenario, "value": scenario} for scenario in scenarios]
+    return scenario_options, {"key": key, "players": cohort["players"]}, status
+
+
+def get_cohort_data(store_data):
+    # Si la cohorte a été évincée du cache, elle est retraitée depuis le cache
+    # local des statements, sans interroger le LRS. Les graphiques de la
+    # cohorte demandés en même temps attendent un seul retraitement.
+    def rebuild():
+        summaries, errors = summarize_cohort(store_data["players"])
+        return build_cohort(summaries, store_data["players"])
+
+    return get_data_cache().get_or_build(store_data["key"], rebuild)
+
+
+def cohort_progress_text(progress, players):
+    text = f"Analyse de {players} joueur(s) en cours... "
+    text += f"{progress.get('synced', 0)} synchronisé(s) avec le LRS"
+    if "processed" in progress:
+        text += f" — {progress['processed']} traité(s)"
+    return text
+
+
+@app.callback(
+    Output("cohort-input", "value"),
+    [Input("cohort-upload", "contents")],
+    [State("cohort-input", "value")],
+    prevent_initial_call=True,
+)
+@metrics.timed_callback
+@profiling.profiled
+def upload_cohort(contents, value):
+    # Fichier texte ou CSV contenant les noms des joueurs
+    if not contents:
+        return dash.no_update
+    content = base64.b64decode(contents.split(",", 1)[1]).decode("utf-8", "replace")
+    return "\n".join(parse_agent_names(f"{value or ''}\n{content}"))
+
+
+@app.callback(
+    Output("cohort-job-store", "data"),
+    [Input("cohort-button", "n_clicks")],
+    [State("cohort-input", "value"), State("cohort-job-store", "data")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def submit_cohort(n_clicks, text, job_data):
+    manager = get_job_manager()
+    if job_data:
+        manager.cancel(job_data["job"])
+    agent_names = parse_agent_names(text)
+    if not agent_names or not n_clicks:
+        return None
+    job = manager.submit(profiling.when_requested(load_cohort_job), agent_names)
+    return {"job": job.id, "players": len(agent_names)}
+
+
+@app.callback(
+    [
+        Output("menu-deroulant-cohort-scenario", "options"),
+        Output("cohort-store", "data"),
+        Output("cohort-status", "children"),
+        Output("cohort-progress", "children"),
+        Output("cohort-poll", "disabled"),
+    ],
+    [Input("cohort-poll", "n_intervals"), Input("cohort-job-store", "data")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_cohort(n_intervals, job_data):
+    if not job_data:
+        return [], None, "", "", True
+    job = get_job_manager().get(job_data["job"])
+    if job is None:
+        return [], None, "Analyse introuvable, réessayez.", "", True
+
+    if job.status in ("pending", "running"):
+        text = cohort_progress_text(job.progress, job_data["players"])
+        if ctx.triggered_id == "cohort-job-store":
+            return [], None, "", text, False
+        return dash.no_update, dash.no_update, "", text, False
+    if job.status == "done":
+        scenario_options, store_data, status = job.result
+        return scenario_options, store_data, status, "", True
+    if job.status == "error":
+        print(job.error)
+        return [], None, "Erreur lors de l'analyse de la cohorte.", "", True
+    return dash.no_update, dash.no_update, "", "", True
+
+
+def cohort_scenario(data, selected_scenario):
+    cohort = get_cohort_data(data)
+    levels = cohort["levels"]
+    summary = cohort["summary"]
+    return (
+        cohort,
+        levels[levels["Scenario"] == selected_scenario],
+        summary[summary["Scenario"] == selected_scenario],
     )
 
-    total_stars_data = []
-    for scenario, levels in star_scores.items():
-        total_stars = len(levels) * 3  # 3 stars per level
-        player_stars = sum(
-            [
-                player_star_data[i]["Nombre d'étoiles du joueur par scénario"]
-                for i in range(len(player_star_data))
-                if player_star_data[i]["Scénario"] == scenario
-            ]
+
+@app.callback(
+    Output("graph-cohort-scores", "figure"),
+    [Input("menu-deroulant-cohort-scenario", "value"), Input("cohort-store", "data")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_cohort_scores(selected_scenario, data):
+    if not selected_scenario or not data:
+        return {}
+    cohort, levels, summary = cohort_scenario(data, selected_scenario)
+
+    # Distribution du meilleur score de chaque joueur sur chaque niveau
+    with metrics.measure("figure"):
+        fig_cohort_scores = px.box(
+            levels.dropna(subset=["max_score"]),
+            x="Mission Level",
+            y="max_score",
+            points="all",
+            hover_data=["Player"],
+            title="Distribution des scores maximum des joueurs par niveau",
         )
-        total_stars_data.append(
-            {
-                "Scénario": scenario,
-                "Nombre d'étoiles total par scénario": total_stars,
-                "Nombre d'étoiles du joueur par scénario": player_stars,
-            }
+        fig_cohort_scores.update_layout(
+            **figure_layout("Niveaux", "Score maximum", base=COHORT_LAYOUT)
         )
+    return fig_cohort_scores
 
-    df_total_stars = pd.DataFrame(total_stars_data)
 
-    # Create a graph comparing Nombre d\'étoiles du joueur par scénario to Nombre d\'étoiles total par scénario required
-    fig_total_stars = px.bar(
-        df_total_stars,
-        x="Scénario",
-        y=[
-            "Nombre d'étoiles du joueur par scénario",
-            "Nombre d'étoiles total par scénario",
-        ],
-        barmode="group",
-        title="Progression du joueur en termes d'étoiles",
-        text_auto=True,
-    )
+@app.callback(
+    Output("graph-cohort-completion", "figure"),
+    [Input("menu-deroulant-cohort-scenario", "value"), Input("cohort-store", "data")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_cohort_completion(selected_scenario, data):
+    if not selected_scenario or not data:
+        return {}
+    cohort, levels, summary = cohort_scenario(data, selected_scenario)
 
-    # Update the layout to differentiate the bars
-    fig_total_stars.update_traces(
-        marker=dict(line=dict(width=1.5, color="DarkSlateGrey"))
-    )
-    fig_total_stars.update_layout(
-        xaxis_title="Scénarios",
-        yaxis_title="Nombre d'étoiles",
-        margin=dict(l=40, r=40, t=40, b=40),
-        yaxis=dict(tickmode="linear", dtick=1),
-        legend_title_text="Type d'étoiles",
-        legend=dict(x=0.5, y=1.1, orientation="h", xanchor="center"),
+    df_completion = summary.assign(
+        **{"Taux de complétion (%)": (summary["completion_rate"] * 100).round(1)}
     )
-    # fig_combined1 = px.bar(df_stars, x='Level', y=['Score maximum', 'Score to get 2 Stars'], barmode='group', color='Scénario', title='Comparaison du score maximum et du score nécessaire pour obtenir 2 étoiles')
-    # fig_combined1.update_traces(texttemplate='%{text}', textposition='outside')
-    # fig_combined1.update_layout(
-    # xaxis_title='Niveaux',
-    # yaxis_title='Scores',
-    # margin=dict(l=40, r=40, t=40, b=40),
-    # yaxis=dict(tickmode='linear', dtick=1)
-    # )
+    with metrics.measure("figure"):
+        fig_cohort_completion = px.bar(
+            df_completion,
+            x="Mission Level",
+            y="Taux de complétion (%)",
+            title=f"Part des {len(cohort['players'])} joueurs ayant complété chaque niveau",
+            text="Taux de complétion (%)",
+            hover_data=["completed_players", "players", "completions"],
+        )
+        fig_cohort_completion.update_traces(texttemplate="%{text}", textposition="outside")
+        fig_cohort_completion.update_layout(
+            **figure_layout(
+                "Niveaux",
+                "Taux de complétion (%)",
+                base=COHORT_LAYOUT,
+                yaxis=dict(range=[0, 110]),
+            )
+        )
+    return fig_cohort_completion
 
-    return (
-        fig_avg_score,
-        fig_max_score,
-        fig_completed_counts,
-        fig_time_spent,
-        fig_player_stars,
-        fig_total_stars,
-    )
+
+@app.callback(
+    Output("graph-cohort-stars", "figure"),
+    [Input("cohort-store", "data")],
+)
+@metrics.timed_callback
+@profiling.profiled
+def update_cohort_stars(data):
+    if not data:
+        return {}
+    stars = get_cohort_data(data)["stars"]
+
+    # Étoiles obtenues par chaque joueur, comparées au total possible
+    with metrics.measure("figure"):
+        fig_cohort_stars = px.box(
+            stars,
+            x="Scénario",
+            y="Nombre d'étoiles du joueur par scénario",
+            points="all",
+            hover_data=["Player"],
+            title="Distribution des étoiles obtenues par scénario",
+        )
+        totals = stars.drop_duplicates("Scénario")
+        fig_cohort_stars.add_scatter(
+            x=totals["Scénario"],
+            y=totals["Nombre d'étoiles total par scénario"],
+            mode="markers",
+            marker=dict(symbol="star", size=14, color="gold"),
+            name="Nombre d'étoiles total par scénario",
+        )
+        fig_cohort_stars.update_layout(
+            **figure_layout("Scénarios", "Nombre d'étoiles", base=COHORT_LAYOUT)
+        )
+    return fig_cohort_stars
+
+
+def start():
+    # Le premier utilisateur ne paie pas la préparation des graphiques : elle
+    # est faite avant que le serveur ne reçoive des requêtes, au lancement
+    # (ici ou dans wsgi.py) et pas à l'import : les processus du pool des
+    # cohortes, démarrés avec "spawn", réimportent ce module sous __mp_main__
+    if flask_compress is None:
+        print(
+            "flask-compress absent : réponses non compressées "
+            "(pip install flask-compress)"
+        )
+    if warmup.WARM_UP:
+        warmup.warm_up(app, build_player_data)
+    warmup.report_startup(STARTED)
 
 
 if __name__ == "__main__":
-    app.run_server(debug=True)
+    start()
+    # Serveur de développement (un seul processus, rechargement automatique) ;
+    # SPY_DEBUG=0 désactive le mode debug
+    app.run(debug=os.environ.get("SPY_DEBUG", "1") != "0")
@@ -0,0 +1,151 @@
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import metrics
+from data_cache import get_data_cache
+from figures import warm_up_figures
+from synthetic import generate_statements
+
+# Préparation au démarrage, désactivée avec SPY_WARMUP=0
+WARM_UP = os.environ.get("SPY_WARMUP", "1") != "0"
+WARM_UP_STATEMENTS = 1000  # Statements du joueur synthétique utilisé
+WARM_UP_PLAYER = "warmup"
+
+_phases = {}  # {phase du démarrage: secondes}
+
+
+def record(name, seconds):
+    _phases[name] = seconds
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+metrics.gauge(
+    "spy_startup_seconds",
+    "Durée des phases du démarrage et des appels de préchauffage des callbacks",
+    lambda: {(("phase", name),): seconds for name, seconds in _phases.items()},
+)
+
+
+def layout_values(layout):
+    # Valeurs initiales des propriétés des composants, celles qu'envoie le
+    # navigateur au premier appel des callbacks
+    values = {}
+    for component in layout._traverse():
+        component_id = getattr(component, "id", None)
+        if not isinstance(component_id, str):
+            continue
+        for name in component._prop_names:
+            value = getattr(component, name, None)
+            if value is not None:
+                values[f"{component_id}.{name}"] = value
+    return values
+
+
+def split_outputs(output):
+    # "..a.figure...b.data.." pour un callback à plusieurs sorties
+    if output.startswith(".."):
+        return output[2:-2].split("...")
+    return [output]
+
+
+def callback_payload(output, callback, values):
+    # Corps d'une requête /_dash-update-component, comme l'envoie le navigateur
+    def props(dependencies):
+        return [
+            dict(dependency, value=values.get(f"{dependency['id']}.{dependency['property']}"))
+            for dependency in dependencies
+        ]
+
+    inputs = props(callback["inputs"])
+    outputs = [
+        {"id": component_id, "property": name}
+        for component_id, name in (
+            prop.rsplit(".", 1) for prop in split_outputs(output)
+        )
+    ]
+    return {
+        "output": output,
+        "outputs": outputs if output.startswith("..") else outputs[0],
+        "inputs": inputs,
+        "state": props(callback["state"]),
+        "changedPropIds": [f"{inputs[0]['id']}.{inputs[0]['property']}"],
+    }
+
+
+def warm_up(app, build_player_data):
+    # Exécute avant la première requête d'un utilisateur tout ce qui est lent
+    # au premier appel : modèle et validateurs Plotly, chemins pandas du
+    # traitement, préparation du serveur Dash et sérialisation JSON des
+    # figures. Chaque callback de graphique est appelé deux fois, sur un
+    # joueur synthétique, pour mesurer le premier appel puis les suivants
+    # (mises à jour partielles des graphiques déjà construits).
+    start = time.perf_counter()
+    with phase("figures"):
+        warm_up_figures()
+    with phase("player_data"):
+        player_data = build_player_data(generate_statements(WARM_UP_STATEMENTS))
+
+    cache = get_data_cache()
+    key = f"warmup/{uuid.uuid4().hex}"
+    cache.put(key, player_data)
+    values = layout_values(app.layout)
+    values.update(
+        {
+            "username-input.value": WARM_UP_PLAYER,
+            "data-store.data": {"key": key, "username": WARM_UP_PLAYER},
+            "menu-deroulant-scenario.value": str(
+                player_data["df"]["Scenario"].dropna().iloc[0]
+            ),
+        }
+    )
+    figure_callbacks = [
+        (output, callback)
+        for output, callback in app.callback_map.items()
+        if any(prop.endswith(".figure") for prop in split_outputs(output))
+    ]
+    client = app.server.test_client()
+    try:
+        with phase("dash_setup"):
+            for path in ("/", "/_dash-layout", "/_dash-dependencies"):
+                client.get(path)
+        for name in ("first_callbacks", "next_callbacks"):
+            with phase(name):
+                for output, callback in figure_callbacks:
+                    response = client.post(
+                        "/_dash-update-component",
+                        json=callback_payload(output, callback, values),
+                    )
+                    if response.status_code not in (200, 204):
+                        print(f"Préchauffage de {output} : erreur {response.status_code}")
+                    elif response.status_code == 200:
+                        # Le navigateur garde les sorties pour les appels suivants
+                        for component_id, props in response.get_json()["response"].items():
+                            for name, value in props.items():
+                                values[f"{component_id}.{name}"] = value
+    finally:
+        cache.discard(key)
+    record("warm_up", time.perf_counter() - start)
+    print(
+        f"Premier appel des {len(figure_callbacks)} callbacks de graphiques : "
+        f"{_phases['first_callbacks'] * 1000:.0f} ms au préchauffage "
+        f"(appels suivants : {_phases['next_callbacks'] * 1000:.0f} ms)"
+    )
+
+
+def report_startup(started):
+    # Durée totale depuis le début des imports de l'application
+    record("startup", time.perf_counter() - started)
+    details = ", ".join(
+        f"{name} {seconds:.2f} s" for name, seconds in _phases.items() if name != "startup"
+    )
+    print(f"Prêt en {_phases['startup']:.2f} s ({details})")
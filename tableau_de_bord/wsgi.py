@@ -0,0 +1,14 @@
+# Point d'entrée de production : l'application WSGI est servie par un serveur
+# multi-processus, sans le mode debug ni le rechargement automatique de
+# app.run(debug=True). Depuis le dossier tableau_de_bord :
+#   gunicorn wsgi:server
+# (configuration lue dans gunicorn.conf.py)
+from tableau_final import app, server, start  # noqa: F401
+import metrics
+
+# Plusieurs processus : /metrics additionne les compteurs et histogrammes de
+# tous, quel que soit celui qui répond
+metrics.share()
+
+# Préchauffage, une fois avant la création des processus (preload_app)
+start()